@@ -0,0 +1,87 @@
+"""
+Compares chat message writes: one insert_one plus one summary bulk_write per
+message vs GroupCommitWriter, which writes both once per batch.
+
+Simulates CONCURRENCY chat connections, each sending MESSAGES messages back to
+back (the next message is sent once the previous one is acknowledged, like
+chat_ws does), and reports throughput and latency percentiles for both paths.
+Writes go to scratch collections that are dropped afterwards.
+
+Usage (from the repository root, with MONGO_URL set):
+    python -m benchmarks.chat_insert [CONCURRENCY] [MESSAGES]
+"""
+from db.dbconn import db
+from db.group_commit import GroupCommitWriter
+from db.conversations import summary_updates
+from datetime import datetime
+import asyncio
+import sys
+import time
+
+BENCH_COLLECTION = "BenchComments"
+BENCH_SUMMARIES = "BenchConversationSummaries"
+
+
+def message(sender: int, n: int) -> dict:
+    return {
+        "task_id": "bench",
+        "task_title": "Benchmark",
+        "text": f"message {n} from {sender}",
+        "created_at": datetime.utcnow(),
+        "author": {"phone": f"+380{sender:09d}", "role": "client"},
+        "receiver": {"phone": "+380000000000"},
+        "type": "question",
+        "conversation": f"bench:+380000000000:+380{sender:09d}"
+    }
+
+
+async def run(name: str, insert, concurrency: int, messages: int):
+    latencies = []
+
+    async def sender(i: int):
+        for n in range(messages):
+            started = time.perf_counter()
+            await insert(message(i, n))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(
+        f"{name:<14} {len(latencies) / elapsed:>10.0f} msg/s"
+        f"   p50 {pct(0.50):>7.2f} ms   p99 {pct(0.99):>7.2f} ms   total {elapsed:.2f}s"
+    )
+
+
+async def main(concurrency: int, messages: int):
+    collection = db.get_collection(BENCH_COLLECTION)
+    summaries = db.get_collection(BENCH_SUMMARIES)
+
+    async def insert_one(document: dict):
+        # The path chat_ws used before group commit: two round trips per message
+        await collection.insert_one(document)
+        await summaries.bulk_write(summary_updates(document), ordered=False)
+
+    async def drop():
+        await collection.drop()
+        await summaries.drop()
+
+    await drop()
+    print(f"{concurrency} senders x {messages} messages")
+    try:
+        await run("insert_one", insert_one, concurrency, messages)
+        await drop()
+        writer = GroupCommitWriter(collection, followup=(summaries, summary_updates))
+        await run("group commit", writer.insert, concurrency, messages)
+    finally:
+        await drop()
+
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(main(concurrency, messages))
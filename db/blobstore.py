@@ -0,0 +1,371 @@
+from db.dbconn import fs, fs_files
+from db.downloads import parse_range, content_type_of, matches_etag, IMMUTABLE_CACHE_CONTROL
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse, FileResponse
+from bson import ObjectId, json_util
+from email.utils import format_datetime
+from datetime import datetime, timezone
+import gridfs
+import asyncio
+import os
+
+# Where photos are written: "gridfs" or "local"; reads also look in the other backend
+BLOB_STORE = os.getenv("BLOB_STORE", "gridfs")
+
+# Root directory of the local backend
+BLOB_LOCAL_DIR = os.getenv("BLOB_LOCAL_DIR", "media")
+
+# Bytes written or read per step
+BLOB_CHUNK_SIZE = int(os.getenv("BLOB_CHUNK_SIZE", str(255 * 1024)))
+
+# Internal location of a reverse proxy (e.g. nginx `internal` alias of BLOB_LOCAL_DIR)
+# that serves local blobs itself; empty to serve them from the application
+BLOB_ACCEL_REDIRECT = os.getenv("BLOB_ACCEL_REDIRECT", "")
+
+
+async def as_chunks(data):
+    # Blob contents may be given as bytes or as an async iterator of chunks
+    if isinstance(data, (bytes, bytearray)):
+        yield bytes(data)
+    else:
+        async for chunk in data:
+            yield chunk
+
+
+def valid_blob_id(blob_id: str) -> bool:
+    return ObjectId.is_valid(blob_id)
+
+
+class GridFSBlobStore:
+    """
+    Blobs as files in the MongoDB GridFS bucket `fs`.
+
+    stat() opens the download stream, so serving a blob takes a single query.
+    """
+
+    name = "gridfs"
+
+    async def write(self, filename: str, data, metadata: dict, blob_id: str = None, upload_date: datetime = None) -> str:
+        grid_in = fs.open_upload_stream_with_id(
+            ObjectId(blob_id) if blob_id else ObjectId(),
+            filename,
+            chunk_size_bytes=BLOB_CHUNK_SIZE,
+            metadata=metadata
+        )
+        try:
+            async for chunk in as_chunks(data):
+                await grid_in.write(chunk)
+            await grid_in.close()
+        except BaseException:
+            await grid_in.abort()
+            raise
+        if upload_date is not None:
+            # Keep the original date (and Last-Modified) when a blob is migrated
+            await fs_files.update_one({"_id": grid_in._id}, {"$set": {"uploadDate": upload_date}})
+        return str(grid_in._id)
+
+    async def stat(self, blob_id: str):
+        if not valid_blob_id(blob_id):
+            return None
+        try:
+            grid_out = await fs.open_download_stream(ObjectId(blob_id))
+        except gridfs.errors.NoFile:
+            return None
+        return {
+            "id": blob_id,
+            "length": grid_out.length,
+            "filename": grid_out.filename,
+            "upload_date": grid_out.upload_date,
+            "metadata": grid_out.metadata or {},
+            "store": self,
+            "grid_out": grid_out
+        }
+
+    async def update_metadata(self, blob_id: str, fields: dict):
+        await fs_files.update_one(
+            {"_id": ObjectId(blob_id)},
+            {"$set": {f"metadata.{key}": value for key, value in fields.items()}}
+        )
+
+    async def delete(self, blob_id: str):
+        try:
+            await fs.delete(ObjectId(blob_id))
+        except gridfs.errors.NoFile:
+            pass
+
+    async def list_ids(self, after: str = None, limit: int = 100) -> list:
+        query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+        docs = await fs_files.find(query, {"_id": 1}).sort("_id", 1).limit(limit).to_list(length=None)
+        return [str(doc["_id"]) for doc in docs]
+
+    async def chunks(self, info: dict, start: int = 0, end: int = None):
+        grid_out = info["grid_out"]
+        end = info["length"] - 1 if end is None else end
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.read(min(BLOB_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    async def response(self, request: Request, info: dict, headers: dict):
+        length = info["length"]
+        byte_range = parse_range(request.headers.get("range"), length) if length else None
+        status_code = 200
+        start, end = 0, length - 1
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            self.chunks(info, start, end),
+            status_code=status_code,
+            media_type=content_type_of(info),
+            headers=headers
+        )
+
+
+class LocalBlobStore:
+    """
+    Blobs as plain files under BLOB_LOCAL_DIR.
+
+    A blob lives at <root>/<id[-2:]>/<id[-4:-2]>/<id>, next to a <id>.json
+    sidecar holding filename, length, upload date and metadata in MongoDB
+    Extended JSON (metadata may contain ObjectIds and dates). Ids are
+    ObjectId strings like GridFS ones, so blobs keep their id when they are
+    migrated. Files are written to a temporary name and renamed into place.
+
+    Zero-copy serving needs a reverse proxy: with BLOB_ACCEL_REDIRECT set the
+    response only carries an X-Accel-Redirect header and nginx sends the file
+    with sendfile (and handles Range itself). Without it, FileResponse serves
+    the file, including Range requests; under uvicorn that means reading it
+    in chunks through the thread pool, not zero-copy.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, blob_id: str) -> str:
+        return os.path.join(self.root, blob_id[-2:], blob_id[-4:-2], blob_id)
+
+    @staticmethod
+    def _write_json(path: str, doc: dict):
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(json_util.dumps(doc))
+            os.replace(path + ".tmp", path)
+        except BaseException:
+            LocalBlobStore._remove(path + ".tmp")
+            raise
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _read_json(path: str):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json_util.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    async def write(self, filename: str, data, metadata: dict, blob_id: str = None, upload_date: datetime = None) -> str:
+        blob_id = blob_id or str(ObjectId())
+        path = self._path(blob_id)
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+        f = await asyncio.to_thread(open, path + ".part", "wb")
+        length = 0
+        try:
+            async for chunk in as_chunks(data):
+                await asyncio.to_thread(f.write, chunk)
+                length += len(chunk)
+            await asyncio.to_thread(f.close)
+
+            sidecar = {
+                "filename": filename,
+                "length": length,
+                "upload_date": upload_date or datetime.utcnow(),
+                "metadata": metadata
+            }
+            await asyncio.to_thread(self._write_json, path + ".json", sidecar)
+            await asyncio.to_thread(os.replace, path + ".part", path)
+        except BaseException:
+            f.close()
+            for leftover in (path + ".part", path + ".json"):
+                await asyncio.to_thread(self._remove, leftover)
+            raise
+        return blob_id
+
+    async def stat(self, blob_id: str):
+        if not valid_blob_id(blob_id):
+            return None
+        path = self._path(blob_id)
+        sidecar = await asyncio.to_thread(self._read_json, path + ".json")
+        if sidecar is None or not await asyncio.to_thread(os.path.exists, path):
+            return None
+        return {
+            "id": blob_id,
+            "length": sidecar["length"],
+            "filename": sidecar.get("filename"),
+            "upload_date": sidecar["upload_date"],
+            "metadata": sidecar.get("metadata") or {},
+            "store": self,
+            "path": path
+        }
+
+    async def update_metadata(self, blob_id: str, fields: dict):
+        path = self._path(blob_id) + ".json"
+
+        def update():
+            sidecar = self._read_json(path)
+            if sidecar is not None:
+                sidecar.setdefault("metadata", {}).update(fields)
+                self._write_json(path, sidecar)
+
+        await asyncio.to_thread(update)
+
+    async def delete(self, blob_id: str):
+        if not valid_blob_id(blob_id):
+            return
+        path = self._path(blob_id)
+        for name in (path, path + ".json"):
+            await asyncio.to_thread(self._remove, name)
+
+    @staticmethod
+    def _listdir(path: str) -> list:
+        try:
+            return sorted(os.listdir(path))
+        except FileNotFoundError:
+            return []
+
+    async def list_ids(self, after: str = None, limit: int = 100) -> list:
+        """
+        Lists blob ids in directory order (shard, sub-shard, id), starting after `after`.
+
+        Only the shard directories from the cursor onwards are listed, so
+        paging through all blobs reads every directory about once.
+        """
+        start = (after[-2:], after[-4:-2], after) if after else None
+
+        def scan():
+            ids = []
+            for top in self._listdir(self.root):
+                if start and top < start[0]:
+                    continue
+                for sub in self._listdir(os.path.join(self.root, top)):
+                    if start and (top, sub) < start[:2]:
+                        continue
+                    for name in self._listdir(os.path.join(self.root, top, sub)):
+                        if not valid_blob_id(name) or (start and (top, sub, name) <= start):
+                            continue
+                        ids.append(name)
+                        if len(ids) >= limit:
+                            return ids
+            return ids
+
+        return await asyncio.to_thread(scan)
+
+    async def chunks(self, info: dict, start: int = 0, end: int = None):
+        end = info["length"] - 1 if end is None else end
+        f = await asyncio.to_thread(open, info["path"], "rb")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(BLOB_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    async def response(self, request: Request, info: dict, headers: dict):
+        if BLOB_ACCEL_REDIRECT:
+            relative = os.path.relpath(info["path"], self.root).replace(os.sep, "/")
+            headers["X-Accel-Redirect"] = f"{BLOB_ACCEL_REDIRECT.rstrip('/')}/{relative}"
+            return Response(media_type=content_type_of(info), headers=headers)
+        return FileResponse(info["path"], media_type=content_type_of(info), headers=headers)
+
+
+class BlobStores:
+    """
+    The configured backend plus the other one as a read fallback.
+
+    New blobs go to the primary backend; lookups, metadata updates and
+    deletes find a blob wherever it currently is, so photos keep working
+    while migrate_blobs moves them between backends.
+    """
+
+    def __init__(self, primary, secondary):
+        self.primary = primary
+        self.secondary = secondary
+
+    async def write(self, filename: str, data, metadata: dict) -> str:
+        return await self.primary.write(filename, data, metadata)
+
+    async def stat(self, blob_id: str):
+        for store in (self.primary, self.secondary):
+            info = await store.stat(blob_id)
+            if info is not None:
+                return info
+        return None
+
+    async def update_metadata(self, blob_id: str, fields: dict):
+        info = await self.stat(blob_id)
+        if info is not None:
+            await info["store"].update_metadata(blob_id, fields)
+
+    async def delete(self, blob_id: str):
+        await asyncio.gather(self.primary.delete(blob_id), self.secondary.delete(blob_id))
+
+
+BACKENDS = {
+    "gridfs": GridFSBlobStore(),
+    "local": LocalBlobStore(BLOB_LOCAL_DIR),
+}
+
+blob_store = BlobStores(
+    BACKENDS[BLOB_STORE],
+    next(store for name, store in BACKENDS.items() if name != BLOB_STORE)
+)
+
+
+async def blob_response(request: Request, blob_id: str):
+    """
+    Serves a blob from whichever backend holds it, with caching and Range support.
+
+    Sends Content-Length, the stored content type, a strong ETag (the blob
+    id; blobs are immutable) and `Cache-Control: immutable`. Answers 304 to a
+    matching If-None-Match without touching storage, and 206 with
+    Content-Range to a single byte range.
+
+    Raises:
+        HTTPException: 404 if the blob does not exist, 416 for unsatisfiable ranges
+    """
+    etag = f'"{blob_id}"'
+    if matches_etag(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+    info = await blob_store.stat(blob_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": "attachment;"
+    }
+    if info["upload_date"]:
+        headers["Last-Modified"] = format_datetime(info["upload_date"].replace(tzinfo=timezone.utc), usegmt=True)
+    return await info["store"].response(request, info, headers)
@@ -0,0 +1,93 @@
+from db.dbconn import conversation_summaries
+from pymongo import UpdateOne
+from datetime import datetime
+
+# Number of characters of the last message kept in a conversation summary
+PREVIEW_LENGTH = 100
+
+
+def conversation_id(task_id: str, phone_a: str, phone_b: str) -> str:
+    """
+    Canonical id of the conversation between two users about a task.
+
+    Both participants get the same id regardless of who wrote first.
+    """
+    low, high = sorted([phone_a, phone_b])
+    return f"{task_id}:{low}:{high}"
+
+
+def summary_pipeline(last_message: dict, other_phone: str, unread: dict) -> list:
+    """
+    Builds the update pipeline that moves one summary to `last_message`.
+
+    `last_message_at` only moves forward; the task title, preview and author
+    of the last message are replaced only when `last_message` is at least as
+    recent as the one stored, so concurrent or reordered writes never move a
+    summary back. `unread` is the expression computing the new unread_count.
+    """
+    created_at = last_message["last_message_at"]
+    newer = {"$or": [
+        {"$eq": [{"$type": "$last_message_at"}, "missing"]},
+        {"$lte": ["$last_message_at", created_at]}
+    ]}
+    return [
+        {"$set": {"_newer": newer}},
+        {"$set": {
+            "task_id": {"$ifNull": ["$task_id", {"$literal": last_message["task_id"]}]},
+            "other_phone": {"$literal": other_phone},
+            "unread_count": unread,
+            "last_message_at": {"$cond": ["$_newer", created_at, "$last_message_at"]},
+            **{
+                field: {"$cond": ["$_newer", {"$literal": last_message[field]}, f"${field}"]}
+                for field in ("task_title", "last_from", "preview")
+            }
+        }},
+        {"$unset": "_newer"}
+    ]
+
+
+def summary_updates(message_doc: dict) -> list:
+    """
+    Builds the summary upserts for both participants of a new comment.
+
+    Both summaries only move forward; the receiver's unread counter is
+    incremented and `live_since` records the first message it counted.
+    """
+    author_phone = message_doc["author"]["phone"]
+    receiver_phone = message_doc["receiver"]["phone"]
+    conversation = conversation_id(message_doc["task_id"], author_phone, receiver_phone)
+    last_message = {
+        "task_id": message_doc["task_id"],
+        "task_title": message_doc.get("task_title"),
+        "last_message_at": message_doc["created_at"],
+        "last_from": author_phone,
+        "preview": (message_doc.get("text") or "")[:PREVIEW_LENGTH]
+    }
+    receiver_pipeline = summary_pipeline(
+        last_message, author_phone, {"$add": [{"$ifNull": ["$unread_count", 0]}, 1]}
+    )
+    receiver_pipeline.insert(-1, {"$set": {"live_since": {"$ifNull": ["$live_since", message_doc["created_at"]]}}})
+    return [
+        UpdateOne(
+            {"owner_phone": author_phone, "conversation_id": conversation},
+            summary_pipeline(last_message, receiver_phone, {"$ifNull": ["$unread_count", 0]}),
+            upsert=True
+        ),
+        UpdateOne(
+            {"owner_phone": receiver_phone, "conversation_id": conversation},
+            receiver_pipeline,
+            upsert=True
+        ),
+    ]
+
+
+async def record_message(message_doc: dict):
+    # Keep both participants' conversation summaries in step with a newly inserted comment
+    await conversation_summaries.bulk_write(summary_updates(message_doc), ordered=False)
+
+
+async def mark_conversation_read(owner_phone: str, task_id: str, other_phone: str):
+    await conversation_summaries.update_one(
+        {"owner_phone": owner_phone, "conversation_id": conversation_id(task_id, owner_phone, other_phone)},
+        {"$set": {"unread_count": 0, "last_read_at": datetime.utcnow()}}
+    )
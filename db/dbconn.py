@@ -1,17 +1,26 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 from dotenv import load_dotenv
-import motor.motor_asyncio as motor_gridfs  
+import motor.motor_asyncio as motor_gridfs
+from pymongo import IndexModel, ASCENDING, DESCENDING
+import time
 
 load_dotenv()
 
 MONGO_URL = os.getenv("MONGO_URL")
 
+# How long a Telegram update_id is remembered to drop webhook redeliveries
+TELEGRAM_UPDATE_TTL = int(os.getenv("TELEGRAM_UPDATE_TTL", "86400"))
+
 client = AsyncIOMotorClient(MONGO_URL)
 
 db = client.get_database("MainDatabase")
 
-fs = motor_gridfs.AsyncIOMotorGridFSBucket(db)  
+fs = motor_gridfs.AsyncIOMotorGridFSBucket(db)
+
+fs_files = db.get_collection("fs.files")
+
+photo_blobs = db.get_collection("PhotoBlobs")
 
 users_collections = db.get_collection("AllUsers")
 
@@ -21,24 +30,147 @@ comments = db.get_collection("Comments")
 
 chat_read_state = db.get_collection("ChatReadState")
 
+conversation_summaries = db.get_collection("ConversationSummaries")
+
 telegram_users = db.get_collection("TelegramUsers")
 
-def create_indexes():
-    comments.create_index("task_id")
-    comments.create_index("created_at")
-    comments.create_index("author.phone")
-    comments.create_index("receiver.phone")
+telegram_bindings = db.get_collection("TelegramBindings")
 
-    chat_read_state.create_index(
-        [
-            ("user_phone", 1),
-            ("task_id", 1),
-            ("other_user_phone", 1),
-        ],
-        unique=True
-    )
+telegram_link_tokens = db.get_collection("TelegramLinkTokens")
 
+telegram_outbox = db.get_collection("TelegramOutbox")
+
+telegram_updates = db.get_collection("TelegramUpdates")
+
+telegram_rate_limits = db.get_collection("TelegramRateLimits")
 
 tasks = db.get_collection("Tasks")
 
+task_series = db.get_collection("TaskSeries")
+
 completedtasks = db.get_collection("CompletedTask")
+
+task_tombstones = db.get_collection("TaskTombstones")
+
+counters = db.get_collection("Counters")
+
+realtime_events = db.get_collection("RealtimeEvents")
+
+realtime_presence = db.get_collection("RealtimePresence")
+
+# Every index the application queries rely on, per collection.
+# create_indexes() builds whatever is missing from this registry.
+INDEXES = {
+    comments: [
+        IndexModel([("task_id", ASCENDING)]),
+        IndexModel([("created_at", ASCENDING)]),
+        IndexModel([("author.phone", ASCENDING)]),
+        IndexModel([("receiver.phone", ASCENDING)]),
+        IndexModel([("conversation", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    chat_read_state: [
+        IndexModel(
+            [
+                ("user_phone", ASCENDING),
+                ("task_id", ASCENDING),
+                ("other_user_phone", ASCENDING),
+            ],
+            unique=True
+        ),
+    ],
+    conversation_summaries: [
+        IndexModel([("owner_phone", ASCENDING), ("conversation_id", ASCENDING)], unique=True),
+        IndexModel([("owner_phone", ASCENDING), ("last_message_at", DESCENDING), ("conversation_id", DESCENDING)]),
+        IndexModel([("owner_phone", ASCENDING), ("unread_count", ASCENDING)]),
+    ],
+    realtime_presence: [
+        IndexModel([("chat_id", ASCENDING), ("phone", ASCENDING)]),
+        IndexModel([("seen_at", ASCENDING)], expireAfterSeconds=120),
+    ],
+    tasks: [
+        IndexModel([("group", ASCENDING), ("importance", DESCENDING), ("start_date", ASCENDING)]),
+        IndexModel([("created_by", ASCENDING), ("end_date", ASCENDING)]),
+        IndexModel([("group", ASCENDING), ("sync_version", ASCENDING)]),
+        IndexModel([("created_by", ASCENDING), ("sync_version", ASCENDING)]),
+    ],
+    task_series: [
+        IndexModel([("group", ASCENDING), ("end_date", ASCENDING)]),
+        IndexModel([("created_by", ASCENDING), ("end_date", ASCENDING)]),
+        IndexModel([("group", ASCENDING), ("sync_version", ASCENDING)]),
+        IndexModel([("created_by", ASCENDING), ("sync_version", ASCENDING)]),
+    ],
+    task_tombstones: [
+        IndexModel([("group", ASCENDING), ("sync_version", ASCENDING)]),
+        IndexModel([("created_by", ASCENDING), ("sync_version", ASCENDING)]),
+        IndexModel([("phones", ASCENDING), ("sync_version", ASCENDING)]),
+    ],
+    completedtasks: [
+        IndexModel([("phone", ASCENDING)]),
+        IndexModel([("phone", ASCENDING), ("finish_at", DESCENDING)]),
+        IndexModel([("group", ASCENDING), ("finish_at", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("finish_at", ASCENDING)]),
+        IndexModel([("id_task", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("id_task", ASCENDING), ("phone", ASCENDING)]),
+        IndexModel([("phone", ASCENDING), ("sync_version", ASCENDING)]),
+    ],
+    groups: [
+        IndexModel([("group_name", ASCENDING)]),
+        IndexModel([("user_phones", ASCENDING)]),
+        IndexModel([("manager_phone", ASCENDING)]),
+    ],
+    users_collections: [
+        IndexModel([("phone", ASCENDING)]),
+    ],
+    telegram_users: [
+        IndexModel([("username", ASCENDING)]),
+        IndexModel([("telegram_id", ASCENDING)]),
+    ],
+    telegram_bindings: [
+        IndexModel([("phone", ASCENDING)], unique=True),
+        IndexModel([("chat_id", ASCENDING)]),
+    ],
+    telegram_link_tokens: [
+        IndexModel([("token", ASCENDING)], unique=True),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    telegram_outbox: [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("locked_until", ASCENDING)]),
+        IndexModel([("phone", ASCENDING), ("window_until", DESCENDING)]),
+        # At most one digest per recipient is collecting messages at a time
+        IndexModel(
+            [("phone", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"status": "collecting"},
+            name="phone_collecting_unique"
+        ),
+        # Delivered and failed messages are kept for a week
+        IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600),
+    ],
+    telegram_rate_limits: [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    telegram_updates: [
+        IndexModel([("update_id", ASCENDING)], unique=True),
+        IndexModel([("received_at", ASCENDING)], expireAfterSeconds=TELEGRAM_UPDATE_TTL),
+    ],
+}
+
+async def create_indexes():
+    """
+    Brings the database indexes in line with the INDEXES registry.
+
+    Existing indexes are compared by name against the registry and only the
+    missing ones are built, in the background, logging how long each took.
+    """
+    for collection, models in INDEXES.items():
+        existing = await collection.index_information()
+        for model in models:
+            name = model.document["name"]
+            if name in existing:
+                continue
+            started = time.perf_counter()
+            model.document.setdefault("background", True)
+            await collection.create_indexes([model])
+            elapsed = time.perf_counter() - started
+            print(f"[INDEX] {collection.name}.{name} built in {elapsed:.2f}s")
@@ -0,0 +1,55 @@
+from fastapi import HTTPException
+import mimetypes
+
+# Blobs never change, so clients may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def parse_range(header: str, length: int):
+    """
+    Parses a single-range `Range: bytes=...` header.
+
+    Returns:
+        tuple: (start, end) inclusive, or None to send the whole file
+               (missing, malformed or multi-range headers)
+
+    Raises:
+        HTTPException: 416 if the range lies outside the file
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start == "":
+            # Suffix range: the last N bytes
+            suffix = int(end)
+            if suffix <= 0:
+                raise ValueError
+            return max(length - suffix, 0), length - 1
+        first = int(start)
+        last = int(end) if end else length - 1
+    except ValueError:
+        return None
+    if first >= length or last < first:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{length}"}
+        )
+    return first, min(last, length - 1)
+
+
+def content_type_of(info: dict) -> str:
+    return (
+        info["metadata"].get("contentType")
+        or mimetypes.guess_type(info.get("filename") or "")[0]
+        # Files stored before content types were recorded are all photos
+        or "image/jpeg"
+    )
+
+
+def matches_etag(header: str, etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
@@ -0,0 +1,137 @@
+from db.dbconn import comments, conversation_summaries, telegram_users, telegram_bindings
+from db.conversations import summary_updates
+from pymongo.errors import BulkWriteError, PyMongoError
+import asyncio
+import os
+
+# A batch is written as soon as it holds this many documents...
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "100"))
+
+# ...or when its first document has waited this many milliseconds
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "5"))
+
+
+class GroupCommitWriter:
+    """
+    Buffers inserts for a collection and writes them with one insert_many.
+
+    insert() resolves once the batch containing the document has been
+    acknowledged, with the document's `_id` set, so callers keep the
+    semantics of insert_one while concurrent writers share round trips.
+    A failed document raises in its own caller only.
+
+    `followup` is an optional (collection, build) pair: build(document)
+    returns write operations derived from each inserted document, and all
+    of them are applied with one bulk_write per batch, in insertion order,
+    before the callers are resolved.
+    """
+
+    def __init__(self, collection, max_batch: int = GROUP_COMMIT_MAX_BATCH, max_delay_ms: float = GROUP_COMMIT_MAX_DELAY_MS, followup=None):
+        self.collection = collection
+        self.followup = followup
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self._buffer = []
+        self._timer = None
+
+    async def insert(self, document: dict):
+        return await self._enqueue(document)
+
+    async def _enqueue(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((item, future))
+        if len(self._buffer) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._buffer = self._buffer, []
+        if batch:
+            asyncio.create_task(self._write(batch))
+
+    async def _write_followup(self, documents: list):
+        if self.followup is None or not documents:
+            return
+        collection, build = self.followup
+        operations = [operation for document in documents for operation in build(document)]
+        try:
+            await collection.bulk_write(operations, ordered=True)
+        except PyMongoError as e:
+            # The documents themselves are stored; only their derived data is behind
+            print(f"[GROUP COMMIT] follow-up writes of {len(documents)} documents failed: {e}")
+
+    async def _write(self, batch: list):
+        documents = [document for document, _ in batch]
+        try:
+            await self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            await self._write_followup([document for index, document in enumerate(documents) if index not in failed])
+            for index, (document, future) in enumerate(batch):
+                # A caller that was cancelled meanwhile no longer waits for its result
+                if future.done():
+                    continue
+                if index in failed:
+                    future.set_exception(BulkWriteError({"writeErrors": [failed[index]]}))
+                else:
+                    future.set_result(document["_id"])
+            return
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        await self._write_followup(documents)
+        for document, future in batch:
+            if not future.done():
+                future.set_result(document["_id"])
+
+
+class BulkWriteBatcher(GroupCommitWriter):
+    """
+    Buffers write operations (UpdateOne, InsertOne, ...) for a collection and
+    applies them with one ordered bulk_write per batch.
+
+    write() resolves once the batch containing the operation has been
+    acknowledged. A failed operation raises in its own caller, and so do the
+    operations after it in the batch, which an ordered bulk_write skips.
+    """
+
+    async def write(self, operation):
+        return await self._enqueue(operation)
+
+    async def _write(self, batch: list):
+        try:
+            await self.collection.bulk_write([operation for operation, _ in batch], ordered=True)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            first = errors[0]["index"] if errors else 0
+            for index, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if index < first:
+                    future.set_result(None)
+                else:
+                    future.set_exception(BulkWriteError({"writeErrors": [errors[0]] if index == first and errors else []}))
+            return
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+
+# Chat comments, with both participants' conversation summaries updated in the same flush
+comment_writer = GroupCommitWriter(comments, followup=(conversation_summaries, summary_updates))
+
+# Writes of the Telegram bot handlers, batched across concurrent webhook updates
+telegram_user_writer = BulkWriteBatcher(telegram_users)
+telegram_binding_writer = BulkWriteBatcher(telegram_bindings)
@@ -0,0 +1,105 @@
+from db.dbconn import groups
+from pymongo.errors import PyMongoError, OperationFailure
+import asyncio
+import os
+import time
+
+# Maximum age of the directory when change streams are unavailable (standalone MongoDB)
+GROUP_DIRECTORY_TTL = float(os.getenv("GROUP_DIRECTORY_TTL", "30"))
+
+
+class GroupDirectory:
+    """
+    In-memory view of AllGroups used for authorization and membership checks.
+
+    Keeps group name -> {group_name, manager_phone, user_phones, active} and the
+    reverse indexes phone -> member groups and phone -> managed groups. Writes in
+    this process call invalidate(); writes from other workers reach it through a
+    change stream (watch), with a TTL reload as fallback. Returned values are
+    shared and must not be mutated by callers.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._groups = {}
+        self._by_member = {}
+        self._by_manager = {}
+        self._loaded_at = 0.0
+        self._stale = True
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    async def _ensure_loaded(self):
+        if not self._stale and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        async with self._lock:
+            if not self._stale and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            # Clear the flag first so an invalidation during the reload is not lost
+            self._stale = False
+            loaded_at = time.monotonic()
+            try:
+                docs = await groups.find(
+                    {}, {"_id": 0, "group_name": 1, "manager_phone": 1, "user_phones": 1, "active": 1}
+                ).to_list(length=None)
+            except PyMongoError:
+                self._stale = True
+                raise
+
+            by_name, by_member, by_manager = {}, {}, {}
+            for doc in docs:
+                doc.setdefault("user_phones", [])
+                by_name[doc["group_name"]] = doc
+                by_manager.setdefault(doc.get("manager_phone"), []).append(doc["group_name"])
+                for phone in doc["user_phones"]:
+                    by_member.setdefault(phone, []).append(doc["group_name"])
+
+            self._groups, self._by_member, self._by_manager = by_name, by_member, by_manager
+            self._loaded_at = loaded_at
+
+    async def get(self, group_name: str):
+        # Group document or None if it does not exist
+        await self._ensure_loaded()
+        return self._groups.get(group_name)
+
+    async def groups_of_member(self, phone: str, active_only: bool = True) -> list:
+        await self._ensure_loaded()
+        return [
+            name for name in self._by_member.get(phone, [])
+            if not active_only or self._groups[name].get("active") == 1
+        ]
+
+    async def managed_by(self, phone: str) -> list:
+        await self._ensure_loaded()
+        return list(self._by_manager.get(phone, []))
+
+    async def active_groups(self) -> dict:
+        # Group name -> member phones for every active group
+        await self._ensure_loaded()
+        return {name: doc["user_phones"] for name, doc in self._groups.items() if doc.get("active") == 1}
+
+    async def watch(self):
+        """
+        Invalidates the directory on every change to AllGroups, from any worker.
+
+        Change streams need a replica set; on a standalone server the directory
+        falls back to reloading every GROUP_DIRECTORY_TTL seconds.
+        """
+        while True:
+            try:
+                async with groups.watch() as stream:
+                    self.invalidate()
+                    async for _ in stream:
+                        self.invalidate()
+            except OperationFailure as e:
+                print(f"[GROUP DIRECTORY] change stream unavailable, using {self.ttl}s TTL: {e}")
+                return
+            except PyMongoError as e:
+                print(f"[GROUP DIRECTORY] change stream error, reconnecting: {e}")
+                self.invalidate()
+                await asyncio.sleep(1)
+
+
+group_directory = GroupDirectory(GROUP_DIRECTORY_TTL)
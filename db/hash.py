@@ -1,4 +1,8 @@
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+import asyncio
+import os
 
 # Initialize a CryptContext instance with bcrypt hashing scheme
 pwd_cxt = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -15,6 +19,47 @@ class Hash:
     def verify(plain_password: str, hashed_password: str) -> bool:
         return pwd_cxt.verify(plain_password, hashed_password)
 
-# print(Hash.bcrypt("adminpass"))
-    
 
+class AsyncHash:
+    """
+    Runs bcrypt hashing and verification in a bounded thread pool.
+
+    At most `max_workers` rounds run at once and at most `queue_limit` more
+    may wait for a free worker. Anything beyond that is rejected with 429,
+    so a burst of logins degrades gracefully instead of stalling the event loop.
+    """
+
+    def __init__(self, max_workers: int, queue_limit: int):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+
+    async def _run(self, func, *args):
+        if self._pending >= self.max_workers + self.queue_limit:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many authentication requests, try again later"
+            )
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    # Hash a password using bcrypt without blocking the event loop
+    async def bcrypt(self, password: str) -> str:
+        return await self._run(Hash.bcrypt, password)
+
+    # Verify a plain password against a hashed password without blocking the event loop
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(Hash.verify, plain_password, hashed_password)
+
+
+async_hash = AsyncHash(
+    max_workers=int(os.getenv("HASH_WORKERS", "2")),
+    queue_limit=int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+)
+
+# print(Hash.bcrypt("adminpass"))
@@ -0,0 +1,58 @@
+"""
+Moves stored files (photos and their variants) from one blob backend to another.
+
+Files keep their ids, so photo references in completions stay valid. Each
+file is copied, its length is verified, and only then is it deleted from the
+source; downloads keep working during the migration because reads fall back
+to the other backend. The migration can be interrupted and started again.
+
+Usage (from the repository root):
+    python -m db.migrate_blobs gridfs local [BATCH_SIZE]
+"""
+from db.blobstore import BACKENDS
+import asyncio
+import sys
+import time
+
+
+async def migrate_blobs(source_name: str, target_name: str, batch_size: int = 100):
+    source, target = BACKENDS[source_name], BACKENDS[target_name]
+    started = time.perf_counter()
+    moved = failed = 0
+    after = None
+
+    while True:
+        batch = await source.list_ids(after, batch_size)
+        if not batch:
+            break
+        for blob_id in batch:
+            after = blob_id
+            info = await source.stat(blob_id)
+            if info is None:
+                continue
+            try:
+                existing = await target.stat(blob_id)
+                if existing is None:
+                    await target.write(
+                        info["filename"], source.chunks(info), info["metadata"],
+                        blob_id=blob_id, upload_date=info["upload_date"]
+                    )
+                    existing = await target.stat(blob_id)
+                if existing is None or existing["length"] != info["length"]:
+                    raise ValueError("length mismatch after copy")
+                await source.delete(blob_id)
+                moved += 1
+            except Exception as e:
+                failed += 1
+                print(f"[MIGRATION] {blob_id} not moved: {e}")
+        print(f"[MIGRATION] {moved} blobs moved, {failed} failed, last id {after}")
+
+    elapsed = time.perf_counter() - started
+    print(f"[MIGRATION] {source_name} -> {target_name}: {moved} blobs moved, {failed} failed in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in BACKENDS or sys.argv[2] not in BACKENDS or sys.argv[1] == sys.argv[2]:
+        print(f"Usage: python -m db.migrate_blobs SOURCE TARGET [BATCH_SIZE]  (backends: {', '.join(BACKENDS)})")
+        sys.exit(1)
+    asyncio.run(migrate_blobs(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 100))
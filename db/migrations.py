@@ -0,0 +1,234 @@
+from db.dbconn import completedtasks, comments, chat_read_state, conversation_summaries, counters
+from db.conversations import conversation_id, summary_pipeline, PREVIEW_LENGTH
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+import time
+
+# Formats the mobile clients use for completion timestamps
+CLIENT_TIME_FORMATS = ("%d.%m.%Y, %H:%M:%S", "%d.%m.%Y,%H:%M:%S")
+
+# Counters document recording that every completion carries native datetimes
+COMPLETION_DATETIMES_MARKER = "completion_datetimes_backfill"
+
+# Counters document recording that conversation summaries were built
+SUMMARIES_MARKER = "conversation_summaries_backfill"
+
+# Seconds a worker holds the summaries build before another may take it over
+SUMMARIES_LEASE = 600
+
+
+def parse_client_time(value):
+    """
+    Parses a client timestamp string (DD.MM.YYYY, HH:MM:SS) into a datetime.
+
+    Returns None if the value is missing or in an unknown format.
+    """
+    if not isinstance(value, str):
+        return None
+    for fmt in CLIENT_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def client_time_expression(field: str) -> dict:
+    # Aggregation counterpart of parse_client_time; null for unknown formats
+    expression = None
+    for fmt in reversed(CLIENT_TIME_FORMATS):
+        parsed = {"$dateFromString": {"dateString": field, "format": fmt, "onError": None, "onNull": None}}
+        expression = parsed if expression is None else {"$ifNull": [parsed, expression]}
+    return expression
+
+
+_completion_datetimes_ready = False
+
+
+async def completion_datetimes_ready() -> bool:
+    # True once the backfill has finished; cached because it never becomes false again
+    global _completion_datetimes_ready
+    if not _completion_datetimes_ready:
+        marker = await counters.find_one({"_id": COMPLETION_DATETIMES_MARKER, "done": True}, {"_id": 1})
+        _completion_datetimes_ready = marker is not None
+    return _completion_datetimes_ready
+
+
+async def finish_at_stages(match: dict, finish_range: dict) -> list:
+    """
+    Builds the pipeline stages selecting completions by `match` whose finish time lies in `finish_range`.
+
+    Once backfill_completion_datetimes has finished this is one indexed
+    `$match` on finish_at. Until then completions without finish_at are
+    still included: their finish_at is derived from the legacy finish_time
+    string, so analytics and exports stay complete during the backfill.
+    """
+    if await completion_datetimes_ready():
+        return [{"$match": {**match, "finish_at": finish_range}}]
+    return [
+        {"$match": match},
+        {"$addFields": {"finish_at": {"$ifNull": ["$finish_at", client_time_expression("$finish_time")]}}},
+        {"$match": {"finish_at": finish_range}}
+    ]
+
+
+async def backfill_completion_datetimes(batch_size: int = 500):
+    """
+    Adds native `finish_at`/`start_at` datetimes to completions stored before dual-writing.
+
+    Documents are converted in batches with one bulk write per batch, so the
+    migration can run online next to regular traffic. Unparseable timestamps
+    are stored as null so they are not picked up again. Completion is
+    recorded in Counters, which switches finish_at_stages to the indexed query.
+    """
+    query = {"finish_time": {"$exists": True}, "finish_at": {"$exists": False}}
+    started = time.perf_counter()
+    converted = 0
+
+    while True:
+        batch = await completedtasks.find(
+            query, {"finish_time": 1, "start_time": 1}
+        ).limit(batch_size).to_list(length=None)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            update = {"finish_at": parse_client_time(doc.get("finish_time"))}
+            if "start_time" in doc:
+                update["start_at"] = parse_client_time(doc.get("start_time"))
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+
+        await completedtasks.bulk_write(operations, ordered=False)
+        converted += len(operations)
+
+    await counters.update_one(
+        {"_id": COMPLETION_DATETIMES_MARKER},
+        {"$set": {"done": True, "done_at": datetime.utcnow()}},
+        upsert=True
+    )
+    if converted:
+        elapsed = time.perf_counter() - started
+        print(f"[MIGRATION] {converted} completions backfilled with native datetimes in {elapsed:.2f}s")
+
+
+async def build_conversation_summaries(batch_size: int = 500):
+    """
+    Builds ConversationSummaries from the existing comments and read states.
+
+    Runs once per deployment: a marker in Counters records completion, and a
+    lease on the same marker keeps the other workers from building in
+    parallel. Comments up to the start of the run are read; summaries that
+    new messages already wrote keep their newer last message, and their
+    unread counter only grows by the unread comments older than the first
+    message it counted live (`live_since`). Each summary is marked
+    `backfilled`, so a run interrupted halfway can simply start again.
+    Afterwards summaries are maintained incrementally whenever a comment is
+    inserted or a chat is read.
+    """
+    now = datetime.utcnow()
+    try:
+        await counters.find_one_and_update(
+            {
+                "_id": SUMMARIES_MARKER,
+                "done": {"$ne": True},
+                "$or": [{"locked_until": {"$exists": False}}, {"locked_until": {"$lte": now}}]
+            },
+            {"$set": {"locked_until": now + timedelta(seconds=SUMMARIES_LEASE)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Already built, or another worker is building
+        return
+    started = time.perf_counter()
+
+    read_at = {}
+    async for state in chat_read_state.find({}, {"_id": 0}):
+        read_at[(state["user_phone"], state["task_id"], state["other_user_phone"])] = state.get("last_read_at")
+
+    summaries = {}
+    async for message in comments.find({"created_at": {"$lte": now}}).sort("created_at", 1):
+        author_phone = message["author"]["phone"]
+        receiver_phone = message["receiver"]["phone"]
+        conversation = conversation_id(message["task_id"], author_phone, receiver_phone)
+        for owner, other in ((author_phone, receiver_phone), (receiver_phone, author_phone)):
+            summary = summaries.setdefault((owner, conversation), {"other_phone": other, "unread_at": []})
+            summary["last_message"] = {
+                "task_id": message["task_id"],
+                "task_title": message.get("task_title"),
+                "last_message_at": message["created_at"],
+                "last_from": author_phone,
+                "preview": (message.get("text") or "")[:PREVIEW_LENGTH]
+            }
+            if owner == receiver_phone:
+                last_read_at = read_at.get((owner, message["task_id"], other))
+                if last_read_at is None or message["created_at"] > last_read_at:
+                    summary["unread_at"].append(message["created_at"])
+
+    operations = []
+    for (owner, conversation), summary in summaries.items():
+        # Unread comments the live counter has not seen: older than its first
+        # counted message and not read since
+        missing = {"$size": {"$filter": {
+            "input": {"$literal": summary["unread_at"]},
+            "as": "at",
+            "cond": {"$and": [
+                {"$or": [{"$eq": [{"$type": "$live_since"}, "missing"]}, {"$lt": ["$$at", "$live_since"]}]},
+                {"$or": [{"$eq": [{"$type": "$last_read_at"}, "missing"]}, {"$gt": ["$$at", "$last_read_at"]}]}
+            ]}
+        }}}
+        unread = {"$add": [
+            {"$ifNull": ["$unread_count", 0]},
+            {"$cond": [{"$eq": ["$backfilled", True]}, 0, missing]}
+        ]}
+        pipeline = summary_pipeline(summary["last_message"], summary["other_phone"], unread)
+        pipeline.insert(-1, {"$set": {"backfilled": True}})
+        operations.append(UpdateOne({"owner_phone": owner, "conversation_id": conversation}, pipeline, upsert=True))
+
+    for i in range(0, len(operations), batch_size):
+        await conversation_summaries.bulk_write(operations[i:i + batch_size], ordered=False)
+        await counters.update_one(
+            {"_id": SUMMARIES_MARKER},
+            {"$set": {"locked_until": datetime.utcnow() + timedelta(seconds=SUMMARIES_LEASE)}}
+        )
+
+    await counters.update_one(
+        {"_id": SUMMARIES_MARKER},
+        {"$set": {"done": True, "done_at": datetime.utcnow()}, "$unset": {"locked_until": ""}}
+    )
+    elapsed = time.perf_counter() - started
+    print(f"[MIGRATION] {len(operations)} conversation summaries built in {elapsed:.2f}s")
+
+
+async def backfill_comment_conversations(batch_size: int = 500):
+    """
+    Adds the canonical `conversation` key to comments stored before it was written.
+
+    Chat history is paged through the (conversation, created_at, _id) index, so
+    older comments only show up in /messages once they carry the key.
+    """
+    query = {"conversation": {"$exists": False}}
+    started = time.perf_counter()
+    converted = 0
+
+    while True:
+        batch = await comments.find(
+            query, {"task_id": 1, "author.phone": 1, "receiver.phone": 1}
+        ).limit(batch_size).to_list(length=None)
+        if not batch:
+            break
+
+        operations = [
+            UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"conversation": conversation_id(doc["task_id"], doc["author"]["phone"], doc["receiver"]["phone"])}}
+            )
+            for doc in batch
+        ]
+        await comments.bulk_write(operations, ordered=False)
+        converted += len(operations)
+
+    if converted:
+        elapsed = time.perf_counter() - started
+        print(f"[MIGRATION] {converted} comments backfilled with conversation keys in {elapsed:.2f}s")
@@ -0,0 +1,51 @@
+from bson import json_util
+import base64
+import binascii
+
+
+def encode_cursor(values: list) -> str:
+    """
+    Encodes the sort key of the last document on a page into an opaque cursor string.
+
+    Datetimes and ObjectIds survive the round trip thanks to BSON extended JSON.
+    """
+    raw = json_util.dumps(values).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Decodes a cursor produced by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def keyset_after(sort: list, values: list) -> dict:
+    """
+    Builds a filter selecting documents strictly after `values` in the given sort order.
+
+    Args:
+        sort (list): Sort specification as (field, direction) pairs, e.g. [("finish_at", -1), ("_id", -1)]
+        values (list): Sort key of the last document of the previous page
+
+    Example:
+        keyset_after([("a", -1), ("_id", -1)], [5, oid])
+        -> {"$or": [{"a": {"$lt": 5}}, {"a": 5, "_id": {"$lt": oid}}]}
+    """
+    if len(sort) != len(values):
+        raise ValueError("Invalid cursor")
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {sort[j][0]: values[j] for j in range(i)}
+        clause[field] = {"$lt" if direction < 0 else "$gt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
@@ -0,0 +1,269 @@
+from db.dbconn import photo_blobs
+from db.blobstore import blob_store
+from fastapi import HTTPException, UploadFile
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime
+from typing import List
+from PIL import Image, ImageOps, UnidentifiedImageError
+import asyncio
+import hashlib
+import io
+import os
+
+# Bytes read from an upload and written to the blob store per step
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(255 * 1024)))
+
+# Photos of one request uploaded at the same time
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "3"))
+
+# Largest accepted photo; bigger uploads are rejected with 413
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Downscaled copies stored next to every photo: variant name -> longest side in pixels
+PHOTO_VARIANTS = {
+    "thumb": int(os.getenv("PHOTO_THUMB_SIZE", "320")),
+    "review": int(os.getenv("PHOTO_REVIEW_SIZE", "1600")),
+}
+
+# JPEG quality of the variants
+PHOTO_VARIANT_QUALITY = int(os.getenv("PHOTO_VARIANT_QUALITY", "80"))
+
+# Largest image decoded for variants, in pixels (about 3 bytes each once decoded);
+# JPEGs count after draft() has reduced them. Larger photos are stored without variants.
+PHOTO_MAX_PIXELS = int(os.getenv("PHOTO_MAX_PIXELS", str(16_000_000)))
+
+# Images declaring more pixels than this are refused by Pillow before decoding
+Image.MAX_IMAGE_PIXELS = int(os.getenv("PHOTO_MAX_SOURCE_PIXELS", str(50_000_000)))
+
+# Attempts to register new content while a released copy of it is still being removed,
+# after which a copy left unreferenced by an interrupted release is taken over
+PHOTO_DEDUP_ATTEMPTS = 10
+
+
+def render_variants(file) -> dict:
+    """
+    Builds the PHOTO_VARIANTS of an image as JPEG bytes.
+
+    The image is rotated according to its EXIF orientation, and the variants
+    are saved without EXIF or other metadata. Variants are never larger than
+    the original. Runs in a worker thread; raises UnidentifiedImageError for
+    files Pillow cannot read and DecompressionBombError for images that would
+    decode to more than PHOTO_MAX_PIXELS.
+    """
+    file.seek(0)
+    with Image.open(file) as original:
+        # JPEG files can be decoded at a reduced scale, which keeps memory low
+        largest = max(PHOTO_VARIANTS.values())
+        original.draft("RGB", (largest, largest))
+        width, height = original.size
+        if width * height > PHOTO_MAX_PIXELS:
+            raise Image.DecompressionBombError(f"{width}x{height} exceeds {PHOTO_MAX_PIXELS} pixels")
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    variants = {}
+    for name, side in sorted(PHOTO_VARIANTS.items(), key=lambda item: -item[1]):
+        image.thumbnail((side, side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=PHOTO_VARIANT_QUALITY, optimize=True, progressive=True)
+        variants[name] = buffer.getvalue()
+    return variants
+
+
+async def store_variants(image: UploadFile, file_id) -> dict:
+    # Stores the variants and links them from the original's blob metadata
+    try:
+        rendered = await asyncio.to_thread(render_variants, image.file)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        print(f"[PHOTOS] no variants for {image.filename}: {e}")
+        return {}
+
+    variants = {}
+    for name, data in rendered.items():
+        variants[name] = await blob_store.write(
+            f"{name}_{image.filename}", data,
+            {"contentType": "image/jpeg", "variant": name, "variant_of": file_id}
+        )
+    await blob_store.update_metadata(file_id, {"variants": variants})
+    return variants
+
+
+def hash_upload(file):
+    """
+    Computes the SHA-256 of a spooled upload, reading it chunk by chunk.
+
+    Returns:
+        tuple: (hex digest, size), or (None, size) once size exceeds UPLOAD_MAX_BYTES
+    """
+    file.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b""):
+        size += len(chunk)
+        if size > UPLOAD_MAX_BYTES:
+            return None, size
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+async def acquire_blob(sha256: str):
+    # Takes a reference on an already stored blob; None if the content is new
+    return await photo_blobs.find_one_and_update(
+        {"_id": sha256, "refcount": {"$gt": 0}},
+        {"$inc": {"refcount": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def blob_ref(blob: dict, filename: str) -> dict:
+    return {
+        "file_id": blob["file_id"],
+        "filename": filename,
+        "variants": blob.get("variants", {}),
+        "sha256": blob["_id"]
+    }
+
+
+async def store_photo(image: UploadFile) -> dict:
+    """
+    Stores one uploaded photo, reusing the stored blob if the same bytes were uploaded before.
+
+    The spooled upload is hashed first; PhotoBlobs maps the SHA-256 to the
+    stored file and its variants with a reference count. New content is
+    streamed into the blob store chunk by chunk (at most UPLOAD_CHUNK_SIZE bytes in
+    memory) and its variants are stored. If the same content is registered
+    concurrently, acquiring and inserting are retried until one of them
+    succeeds, so every returned reference is counted. Uploads above
+    UPLOAD_MAX_BYTES are rejected with 413.
+
+    Returns:
+        dict: Photo reference stored in the completion's `photos`
+    """
+    sha256, size = await asyncio.to_thread(hash_upload, image.file)
+    if sha256 is None:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Файл {image.filename} перевищує {UPLOAD_MAX_BYTES // (1024 * 1024)} МБ"
+        )
+
+    blob = await acquire_blob(sha256)
+    if blob:
+        return blob_ref(blob, image.filename)
+
+    ref = await upload_photo(image)
+    document = {
+        "_id": sha256,
+        "file_id": ref["file_id"],
+        "variants": ref["variants"],
+        "size": size,
+        "refcount": 1,
+        "created_at": datetime.utcnow()
+    }
+    try:
+        attempt = 0
+        while True:
+            try:
+                await photo_blobs.insert_one(document)
+                break
+            except DuplicateKeyError:
+                # The same content was stored concurrently; keep one copy
+                blob = await acquire_blob(sha256)
+                if blob:
+                    await delete_files(ref)
+                    return blob_ref(blob, image.filename)
+            # The existing copy is down to no references and about to be removed
+            attempt += 1
+            if attempt >= PHOTO_DEDUP_ATTEMPTS:
+                taken = await photo_blobs.replace_one({"_id": sha256, "refcount": {"$lte": 0}}, document)
+                if taken.matched_count:
+                    break
+            await asyncio.sleep(0.01 * attempt)
+    except BaseException:
+        await delete_files(ref)
+        raise
+    ref["sha256"] = sha256
+    return ref
+
+
+async def upload_chunks(image: UploadFile):
+    await image.seek(0)
+    while True:
+        chunk = await image.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def upload_photo(image: UploadFile) -> dict:
+    # Streams the upload into the blob store chunk by chunk, then stores its variants
+    file_id = await blob_store.write(image.filename, upload_chunks(image), {"contentType": image.content_type})
+    try:
+        variants = await store_variants(image, file_id)
+    except BaseException:
+        await delete_files({"file_id": file_id})
+        raise
+
+    return {
+        "file_id": file_id,
+        "filename": image.filename,
+        "variants": variants
+    }
+
+
+async def release_photo(ref: dict):
+    """
+    Drops one reference to a stored photo.
+
+    The stored files are deleted once no reference is left, or right away
+    for photos stored without a content hash.
+    """
+    sha256 = ref.get("sha256")
+    if sha256:
+        blob = await photo_blobs.find_one_and_update(
+            {"_id": sha256}, {"$inc": {"refcount": -1}}, return_document=ReturnDocument.AFTER
+        )
+        if blob and blob["refcount"] > 0:
+            return
+        if blob and (await photo_blobs.delete_one({"_id": sha256, "refcount": {"$lte": 0}})).deleted_count == 0:
+            return
+    await delete_files(ref)
+
+
+async def delete_files(ref: dict):
+    # Removes a photo's file and all of its variants
+    file_ids = [ref["file_id"], *ref.get("variants", {}).values()]
+    await asyncio.gather(*(blob_store.delete(file_id) for file_id in file_ids), return_exceptions=True)
+
+
+async def variant_file_id(file_id: str, size: str) -> str:
+    """
+    Resolves the blob id of a photo variant.
+
+    Falls back to the original for files stored without variants.
+    """
+    info = await blob_store.stat(file_id)
+    variant = info["metadata"].get("variants", {}).get(size) if info else None
+    return variant or file_id
+
+
+async def store_photos(images: List[UploadFile]) -> list:
+    """
+    Uploads the photos of one request concurrently, at most UPLOAD_CONCURRENCY at a time.
+
+    Either all photos are stored or none: if one fails, the references taken
+    for the others are released and the first error is raised.
+    """
+    limit = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async def upload(image: UploadFile):
+        async with limit:
+            return await store_photo(image)
+
+    results = await asyncio.gather(*(upload(image) for image in images), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        stored = [r for r in results if not isinstance(r, BaseException)]
+        await asyncio.gather(*(release_photo(ref) for ref in stored))
+        raise errors[0]
+    return results
@@ -0,0 +1,108 @@
+from db.dbconn import counters, task_tombstones, tasks, task_series
+from pymongo import ReturnDocument
+from datetime import datetime
+import os
+
+# Seconds of versions re-sent on every sync to cover writes that allocated a
+# version but were not yet visible when the previous sync ran
+SYNC_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", "30"))
+
+# Versions are microsecond timestamps (never less than the previous value + 1)
+VERSIONS_PER_SECOND = 1_000_000
+
+# Width of the overlap in version units
+SYNC_VERSION_OVERLAP = SYNC_OVERLAP_SECONDS * VERSIONS_PER_SECOND
+
+
+async def next_sync_version() -> int:
+    """
+    Allocates the next value of the global, monotonic sync version.
+
+    Every write to tasks, task series and completions stamps its document with
+    one, so clients can ask for everything that changed after a version they hold.
+    Versions follow the server clock (in microseconds), so an overlap of
+    SYNC_VERSION_OVERLAP covers every write that started within the last
+    SYNC_OVERLAP_SECONDS, however many other writes happened meanwhile.
+    """
+    counter = await counters.find_one_and_update(
+        {"_id": "sync_version"},
+        [{"$set": {"value": {"$max": [
+            {"$add": ["$value", 1]},
+            {"$multiply": [{"$toLong": "$$NOW"}, VERSIONS_PER_SECOND // 1000]}
+        ]}}}],
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["value"]
+
+
+async def current_sync_version() -> int:
+    counter = await counters.find_one({"_id": "sync_version"})
+    return counter["value"] if counter else 0
+
+
+async def sync_stamp() -> dict:
+    # Fields added to every synced write
+    return {"updated_at": datetime.utcnow(), "sync_version": await next_sync_version()}
+
+
+async def record_tombstones(deleted: list, series: bool = False, phones: list = (), by_group: bool = True):
+    """
+    Records deleted tasks (or whole task series) so delta sync can report them.
+
+    Args:
+        deleted (list): Deleted documents, each with at least _id, group and created_by
+        series (bool): True if the documents are task series rather than tasks
+        phones (list): Users who must receive the tombstone even though the group
+            is no longer in their sync scope (members of a deleted group, removed members)
+        by_group (bool): False to address the tombstone only to `phones`, e.g. when
+            members lose access to tasks that still exist for the rest of the group
+    """
+    if not deleted:
+        return
+    stamp = await sync_stamp()
+    await task_tombstones.insert_many([
+        {
+            "task_id": str(doc["_id"]),
+            "series": series,
+            "group": doc.get("group") if by_group else None,
+            "created_by": doc.get("created_by") if by_group else None,
+            "phones": list(phones),
+            "deleted_at": stamp["updated_at"],
+            "sync_version": stamp["sync_version"]
+        }
+        for doc in deleted
+    ])
+
+
+async def tombstone_group_for(group_name: str, phones: list):
+    """
+    Tells `phones` to drop the tasks and series of a group they can no longer see.
+
+    Used when members are removed from a group or the group is deactivated.
+    Tasks a phone created itself stay in its sync scope through created_by, so
+    each creator's documents are addressed to everyone but the creator.
+    """
+    phones = set(phones)
+    if not phones:
+        return
+    projection = {"_id": 1, "group": 1, "created_by": 1}
+    for collection, series in ((tasks, False), (task_series, True)):
+        by_creator = {}
+        async for doc in collection.find({"group": group_name}, projection):
+            by_creator.setdefault(doc.get("created_by"), []).append(doc)
+        for creator, docs in by_creator.items():
+            await record_tombstones(docs, series=series, phones=sorted(phones - {creator}), by_group=False)
+
+
+async def resend_group(group_name: str):
+    """
+    Moves every task and series of a group past the current sync version.
+
+    Used when the group enters someone's sync scope (a member is added, the
+    group is reactivated): its existing documents carry versions older than
+    those users' version tokens and would otherwise never be sent to them.
+    """
+    version = {"$set": {"sync_version": await next_sync_version()}}
+    await tasks.update_many({"group": group_name}, version)
+    await task_series.update_many({"group": group_name}, version)
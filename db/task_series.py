@@ -0,0 +1,146 @@
+from db.dbconn import task_series, completedtasks
+from bson import ObjectId
+from datetime import datetime, timedelta
+import calendar
+import os
+
+# Task types stored once as a recurrence rule instead of one document per day
+SERIES_TASK_TYPES = ("general", "weekly")
+
+# Days of occurrences expanded when a client asks for tasks without a window
+DEFAULT_OCCURRENCE_WINDOW_DAYS = int(os.getenv("DEFAULT_OCCURRENCE_WINDOW_DAYS", "31"))
+
+# Fields that can be changed for a single occurrence; the schedule and group stay with the series
+OCCURRENCE_FIELDS = (
+    "title", "description", "start_time", "end_time", "importance",
+    "needcomment", "needphoto", "openquestion"
+)
+
+
+def occurrence_id(series_id, day: str) -> str:
+    """
+    Builds the id of a single occurrence of a series, e.g. "507f1f77bcf86cd799439011:2023-01-02".
+
+    Occurrence ids are used everywhere a plain task id is used (completions, chats, URLs).
+    """
+    return f"{series_id}:{day}"
+
+
+def parse_occurrence_id(task_id: str):
+    """
+    Splits an occurrence id into the series ObjectId and the occurrence day.
+
+    Returns None if `task_id` is not an occurrence id.
+    """
+    series_id, sep, day = task_id.partition(":")
+    if not sep or not ObjectId.is_valid(series_id):
+        return None
+    try:
+        datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        return None
+    return ObjectId(series_id), day
+
+
+def series_days(series: dict, window_start: str = None, window_end: str = None) -> list:
+    """
+    Lists the days (YYYY-MM-DD) on which a series occurs, optionally clipped to a window.
+    """
+    start = max(series["start_date"], window_start) if window_start else series["start_date"]
+    end = min(series["end_date"], window_end) if window_end else series["end_date"]
+    current = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+
+    weekday_indices = None
+    if series["task_type"] == "weekly":
+        weekday_indices = [list(calendar.day_name).index(day) for day in series.get("repeat_days", [])]
+
+    days = []
+    while current <= last:
+        if weekday_indices is None or current.weekday() in weekday_indices:
+            days.append(current.strftime("%Y-%m-%d"))
+        current += timedelta(days=1)
+    return days
+
+
+def expand_series(series: dict, window_start: str = None, window_end: str = None, completions: dict = None) -> list:
+    """
+    Expands a series into task-shaped occurrences, merged with their per-occurrence overrides.
+
+    Occurrences deleted through an override are skipped. If `completions`
+    (occurrence id -> the user's completion) is given, every occurrence gets
+    its `completion`, or None if it was not completed.
+    """
+    overrides = series.get("overrides", {})
+    base = {k: v for k, v in series.items() if k not in ("_id", "overrides")}
+    occurrences = []
+    for day in series_days(series, window_start, window_end):
+        override = overrides.get(day, {})
+        if override.get("deleted"):
+            continue
+        occurrence = dict(base)
+        occurrence["start_date"] = day
+        occurrence["end_date"] = day
+        occurrence.update(override)
+        occurrence["_id"] = occurrence_id(series["_id"], day)
+        occurrence["series_id"] = str(series["_id"])
+        if completions is not None:
+            occurrence["completion"] = completions.get(occurrence["_id"])
+        occurrences.append(occurrence)
+    return occurrences
+
+
+def window_query(window_start: str = None, window_end: str = None) -> dict:
+    # Series overlapping the [window_start, window_end] range
+    query = {}
+    if window_end:
+        query["start_date"] = {"$lte": window_end}
+    if window_start:
+        query["end_date"] = {"$gte": window_start}
+    return query
+
+
+async def find_occurrences(query: dict, window_start: str = None, window_end: str = None, phone: str = None) -> list:
+    """
+    Loads the series matching `query` that overlap the window and expands their occurrences.
+
+    With `phone`, the user's completions of the expanded occurrences are
+    loaded in one query and merged into them.
+    """
+    query = {**query, **window_query(window_start, window_end)}
+    series_list = await task_series.find(query).to_list(length=None)
+    completions = None
+    if phone is not None:
+        ids = [
+            occurrence_id(series["_id"], day)
+            for series in series_list
+            for day in series_days(series, window_start, window_end)
+        ]
+        completions = {}
+        if ids:
+            async for completion in completedtasks.find(
+                {"phone": phone, "id_task": {"$in": ids}},
+                {"_id": 0, "id_task": 1, "status": 1, "finish_at": 1}
+            ):
+                completions[completion.pop("id_task")] = completion
+    occurrences = []
+    for series in series_list:
+        occurrences.extend(expand_series(series, window_start, window_end, completions))
+    return occurrences
+
+
+async def get_occurrence(task_id: str):
+    """
+    Returns a single occurrence by its id, or None if it does not exist or was deleted.
+    """
+    parsed = parse_occurrence_id(task_id)
+    if not parsed:
+        return None
+    series_id, day = parsed
+    series = await task_series.find_one({"_id": series_id})
+    if not series:
+        return None
+    occurrences = expand_series(series, day, day)
+    if not occurrences:
+        return None
+    return occurrences[0]
@@ -0,0 +1,105 @@
+from db.dbconn import users_collections, telegram_users, telegram_bindings
+from collections import OrderedDict
+import os
+import time
+
+# How long a cached profile is trusted before it is read again
+USER_DIRECTORY_TTL = float(os.getenv("USER_DIRECTORY_TTL", "60"))
+
+# Upper bound for the number of cached profiles
+USER_DIRECTORY_SIZE = int(os.getenv("USER_DIRECTORY_SIZE", "10000"))
+
+# Default seconds new-message notifications are collected into one digest
+NOTIFICATION_WINDOW = float(os.getenv("NOTIFICATION_WINDOW", "30"))
+
+
+class UserDirectory:
+    """
+    Phone-keyed cache of user profiles with TTL and explicit invalidation.
+
+    A profile is the AllUsers document without the password (`_id` as str)
+    plus `telegram_chat_id`, taken from the phone's TelegramBindings entry or,
+    for users who never used a /start link, from TelegramUsers by username.
+    Unknown phones are cached as well, so repeated misses do not hit the database.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def invalidate(self, phone: str = None):
+        # Drop one phone, or the whole cache when no phone is given
+        if phone is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(phone, None)
+
+    async def get(self, phone: str):
+        return (await self.get_many([phone])).get(phone)
+
+    async def get_many(self, phones) -> dict:
+        """
+        Resolves many phones with at most one query per collection.
+
+        Returns:
+            dict: phone -> profile for every phone that belongs to a user
+        """
+        now = time.monotonic()
+        result, missing = {}, []
+        for phone in dict.fromkeys(phones):
+            entry = self._entries.get(phone)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(phone)
+                if entry[1] is not None:
+                    result[phone] = entry[1]
+            else:
+                missing.append(phone)
+
+        if missing:
+            loaded = {}
+            async for user in users_collections.find({"phone": {"$in": missing}}, {"password": 0}):
+                user["_id"] = str(user["_id"])
+                user["telegram_chat_id"] = None
+                loaded[user["phone"]] = user
+
+            if loaded:
+                async for binding in telegram_bindings.find(
+                    {"phone": {"$in": list(loaded)}}, {"_id": 0, "phone": 1, "chat_id": 1}
+                ):
+                    loaded[binding["phone"]]["telegram_chat_id"] = binding["chat_id"]
+
+            usernames = {
+                u.get("telegramName"): u for u in loaded.values()
+                if u.get("telegramName") and u["telegram_chat_id"] is None
+            }
+            if usernames:
+                async for tg in telegram_users.find(
+                    {"username": {"$in": list(usernames)}}, {"_id": 0, "username": 1, "chat_id": 1}
+                ):
+                    usernames[tg["username"]]["telegram_chat_id"] = tg.get("chat_id")
+
+            expires_at = now + self.ttl
+            for phone in missing:
+                self._entries[phone] = (expires_at, loaded.get(phone))
+                self._entries.move_to_end(phone)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            result.update(loaded)
+
+        return result
+
+
+def public_profile(profile: dict, exclude=()) -> dict:
+    # Profile as returned to API clients, without internal delivery fields
+    return {k: v for k, v in profile.items() if k != "telegram_chat_id" and k not in exclude}
+
+
+user_directory = UserDirectory(USER_DIRECTORY_TTL, USER_DIRECTORY_SIZE)
+
+
+async def notification_window(phone: str) -> float:
+    # Per-user digest window (AllUsers.notification_window), NOTIFICATION_WINDOW if unset
+    profile = await user_directory.get(phone)
+    window = profile.get("notification_window") if profile else None
+    return NOTIFICATION_WINDOW if window is None else window
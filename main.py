@@ -1,11 +1,17 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
 from db.dbconn import users_collections, create_indexes
+from db.migrations import backfill_completion_datetimes, build_conversation_summaries, backfill_comment_conversations
+from db.group_directory import group_directory
+from realtime.broker import broker
+from telegramfiles.outbox import outbox_dispatcher
 from fastapi.middleware.cors import CORSMiddleware
 from routes.users import user_app as users  
 from telegramfiles.startpage import application
+from telegramfiles.webhook import webhook_ingestor
 import os
 from telegram import Update
 import datetime
+import asyncio
 
 app = FastAPI()
 
@@ -19,7 +25,13 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def init_admin():
-    create_indexes()
+    await create_indexes()
+    asyncio.create_task(backfill_completion_datetimes())
+    asyncio.create_task(build_conversation_summaries())
+    asyncio.create_task(backfill_comment_conversations())
+    asyncio.create_task(group_directory.watch())
+    await broker.start()
+    outbox_dispatcher.start()
     admin = await users_collections.find_one({"phone": "+380111111111"})
     if not admin:
         await users_collections.insert_one({
@@ -32,15 +44,23 @@ async def init_admin():
         print("ℹ️ Admin user already exists")
     
     await application.initialize()
+    webhook_ingestor.start()
     await application.bot.set_webhook(
         url=f"{os.getenv('WEBHOOK_URL')}/telegram/webhook"
     )
 
+@app.on_event("shutdown")
+async def shutdown():
+    await broker.stop()
+    await outbox_dispatcher.stop()
+    await webhook_ingestor.stop()
+
 @app.post("/telegram/webhook")
 async def telegram_webhook(request: Request):
     data = await request.json()
-    update = Update.de_json(data, application.bot)
-    await application.process_update(update)
+    # Acknowledge right away; slow handlers would make Telegram resend the update
+    if not await webhook_ingestor.submit(data):
+        raise HTTPException(status_code=503, detail="Webhook queue is full")
     return {"ok": True}
 
 app.include_router(users)
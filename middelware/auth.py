@@ -7,17 +7,88 @@ from dotenv import load_dotenv
 load_dotenv()
 from datetime import datetime
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from collections import OrderedDict
+import time
 
 # Import HTTPBearer for authorization and token handling
 security = HTTPBearer()
 
+SECRET_JWT = os.getenv("SecretJwt")
+
+# Upper bound for the number of verified tokens kept in memory
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "4096"))
+
+# Lifetime of cached claims for tokens issued without an 'exp' claim
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+
+
+class PrincipalCache:
+    """
+    Bounded LRU cache of verified JWT claims keyed by the raw token.
+
+    Every entry expires at the token's own 'exp' claim, so a cached token
+    stops resolving exactly when jwt.decode would start rejecting it.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, token: str):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires_at, claims = entry
+        if expires_at <= time.time():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return claims
+
+    def put(self, token: str, claims: dict):
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)):
+            expires_at = time.time() + PRINCIPAL_CACHE_TTL
+        self._entries[token] = (expires_at, claims)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE)
+
+
+def resolve_principal(token: str) -> dict:
+    """
+    Returns the verified claims of a token, decoding it at most once while it is valid.
+
+    Raises:
+        JWTError: If the token is invalid or expired
+    """
+    claims = principal_cache.get(token)
+    if claims is None:
+        # Decode the JWT token using the secret key and HS256 algorithm
+        claims = jwt.decode(token, SECRET_JWT, algorithms=["HS256"])
+        principal_cache.put(token, claims)
+    return claims
+
+
+async def request_principal(request: Request) -> dict:
+    # Resolve the bearer token once per request and share the claims between dependencies
+    claims = getattr(request.state, "principal", None)
+    if claims is None:
+        credentials: HTTPAuthorizationCredentials = await security(request)
+        claims = resolve_principal(credentials.credentials)
+        request.state.principal = claims
+    return claims
+
 # Middleware to extract and return the email from the token payload
 async def auth_middleware_status_return(request: Request):
     try:
-        credentials: HTTPAuthorizationCredentials = await security(request)
-        token = credentials.credentials
-        # Decode the JWT token using the secret key and HS256 algorithm
-        payload = jwt.decode(token, os.getenv("SecretJwt"), algorithms=["HS256"])
+        payload = await request_principal(request)
         # Return email from the payload
         return str(payload.get("status"))
     except JWTError:
@@ -30,10 +101,7 @@ async def auth_middleware_status_return(request: Request):
 
 async def auth_middleware_phone_return(request: Request):
     try:
-        credentials: HTTPAuthorizationCredentials = await security(request)
-        token = credentials.credentials
-        # Decode the JWT token using the secret key and HS256 algorithm
-        payload = jwt.decode(token, os.getenv("SecretJwt"), algorithms=["HS256"])
+        payload = await request_principal(request)
         # Return email from the payload
         return str(payload.get("sub"))
     except JWTError:
@@ -48,7 +116,7 @@ async def verify_admin_token(request: Request):
     """
     Verifies if the user is an admin.
 
-    Decodes the JWT token and checks if the user is an admin 
+    Decodes the JWT token and checks if the user is an admin
     by validating the 'sub' field. Raises 403 if not authorized.
 
     Parameters:
@@ -58,10 +126,8 @@ async def verify_admin_token(request: Request):
     - If the token is valid and the user is an admin, stores the payload in `request.state.user`.
     """
     try:
-        credentials: HTTPAuthorizationCredentials = await security(request)
-        token = credentials.credentials
-        payload = jwt.decode(token, os.getenv("SecretJwt"), algorithms=["HS256"])
-        
+        payload = await request_principal(request)
+
         # Check if the user is an admin
         if payload.get("status") != "admin":
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized.")
@@ -69,4 +135,4 @@ async def verify_admin_token(request: Request):
     except JWTError:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token is invalid or expired.")
     except Exception as e:
-        raise HTTPException(status_code=403, detail=f"Authorization error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=403, detail=f"Authorization error: {str(e)}")
@@ -0,0 +1,235 @@
+from realtime.outbound import OutboundSocket, notification_key
+from realtime.digest import DigestBuffer
+from db.user_directory import notification_window
+from db.dbconn import db, realtime_events, realtime_presence, counters
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import PyMongoError, CollectionInvalid
+from bson import ObjectId
+from datetime import datetime
+from typing import Dict
+import asyncio
+import os
+
+# "memory" for a single process, "mongo" to fan out across workers and containers
+REALTIME_BROKER = os.getenv("REALTIME_BROKER", "memory")
+
+# Size of the capped collection carrying realtime events between workers
+REALTIME_EVENTS_SIZE = int(os.getenv("REALTIME_EVENTS_SIZE", str(16 * 1024 * 1024)))
+
+# How often a worker confirms that its chat presence entries are still alive
+PRESENCE_HEARTBEAT = float(os.getenv("PRESENCE_HEARTBEAT", "30"))
+
+# Events seen ahead of a gap in the sequence before the gap is given up on
+# (a publisher that died between taking its number and inserting)
+REALTIME_SEQ_WINDOW = int(os.getenv("REALTIME_SEQ_WINDOW", "1000"))
+
+
+class ConnectionHub:
+    """
+    WebSockets connected to this worker.
+
+    Chat sockets are grouped by chat_id and phone, notification sockets by phone.
+    Delivery only reaches local sockets; brokers decide which worker delivers what.
+    Delivering only queues the message on each socket, it never waits for a client.
+    new_message notifications are coalesced per recipient into digests.
+    """
+
+    def __init__(self):
+        self.chats: Dict[str, Dict[str, OutboundSocket]] = {}
+        self.notifications: Dict[str, OutboundSocket] = {}
+        self.digests = DigestBuffer(self._send_notification)
+
+    def add_chat(self, chat_id: str, phone: str, websocket: OutboundSocket):
+        self.chats.setdefault(chat_id, {})[phone] = websocket
+
+    def remove_chat(self, chat_id: str, phone: str, websocket: OutboundSocket):
+        room = self.chats.get(chat_id, {})
+        if room.get(phone) is websocket:
+            del room[phone]
+        if not room:
+            self.chats.pop(chat_id, None)
+
+    def in_chat(self, chat_id: str, phone: str) -> bool:
+        return phone in self.chats.get(chat_id, {})
+
+    def add_notification(self, phone: str, websocket: OutboundSocket):
+        self.notifications[phone] = websocket
+
+    def remove_notification(self, phone: str, websocket: OutboundSocket):
+        if self.notifications.get(phone) is websocket:
+            del self.notifications[phone]
+
+    async def deliver_chat(self, chat_id: str, message: dict):
+        for ws in list(self.chats.get(chat_id, {}).values()):
+            ws.send(message)
+
+    async def deliver_notification(self, phone: str, message: dict):
+        if phone not in self.notifications:
+            return
+        if message.get("type") == "new_message":
+            self.digests.add(phone, message, await notification_window(phone))
+        else:
+            self._send_notification(phone, message)
+
+    def _send_notification(self, phone: str, message: dict):
+        ws = self.notifications.get(phone)
+        if ws:
+            ws.send(message, key=notification_key(message))
+
+
+class InMemoryBroker:
+    """
+    Broker for a single process: publishing delivers straight to the local hub.
+    """
+
+    def __init__(self, hub: ConnectionHub):
+        self.hub = hub
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish_chat(self, chat_id: str, message: dict):
+        await self.hub.deliver_chat(chat_id, message)
+
+    async def publish_notification(self, phone: str, message: dict):
+        await self.hub.deliver_notification(phone, message)
+
+    async def join_chat(self, chat_id: str, phone: str, websocket: OutboundSocket):
+        self.hub.add_chat(chat_id, phone, websocket)
+
+    async def leave_chat(self, chat_id: str, phone: str, websocket: OutboundSocket):
+        self.hub.remove_chat(chat_id, phone, websocket)
+
+    async def is_in_chat(self, chat_id: str, phone: str) -> bool:
+        return self.hub.in_chat(chat_id, phone)
+
+
+class MongoBroker(InMemoryBroker):
+    """
+    Broker for several workers or containers sharing one MongoDB.
+
+    Events are appended to a capped collection that every worker tails with an
+    awaitable cursor (this works on standalone servers, unlike change streams).
+    Each worker delivers the events to its own sockets; events published by the
+    worker itself are delivered locally right away and skipped in the tail.
+    Every event carries a sequence number from Counters; after a lost cursor
+    the tail resumes after the last number up to which nothing is missing,
+    skipping the events it already delivered.
+    Chat presence is shared through RealtimePresence so any worker can tell
+    whether the receiver has the chat open.
+    """
+
+    def __init__(self, hub: ConnectionHub):
+        super().__init__(hub)
+        self.worker_id = str(ObjectId())
+        self._tasks = []
+
+    async def start(self):
+        try:
+            await db.create_collection(realtime_events.name, capped=True, size=REALTIME_EVENTS_SIZE)
+        except CollectionInvalid:
+            pass
+        self._tasks = [asyncio.create_task(self._tail()), asyncio.create_task(self._heartbeat())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await realtime_presence.delete_many({"worker_id": self.worker_id})
+
+    async def _publish(self, channel: str, key: str, message: dict):
+        counter = await counters.find_one_and_update(
+            {"_id": "realtime_events"},
+            {"$inc": {"value": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        await realtime_events.insert_one({
+            "seq": counter["value"],
+            "channel": channel,
+            "key": key,
+            "message": message,
+            "origin": self.worker_id
+        })
+
+    async def publish_chat(self, chat_id: str, message: dict):
+        await self.hub.deliver_chat(chat_id, message)
+        await self._publish("chat", chat_id, message)
+
+    async def publish_notification(self, phone: str, message: dict):
+        await self.hub.deliver_notification(phone, message)
+        await self._publish("notification", phone, message)
+
+    async def join_chat(self, chat_id: str, phone: str, websocket: OutboundSocket):
+        await super().join_chat(chat_id, phone, websocket)
+        await realtime_presence.update_one(
+            {"chat_id": chat_id, "phone": phone, "worker_id": self.worker_id},
+            {"$set": {"seen_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def leave_chat(self, chat_id: str, phone: str, websocket: OutboundSocket):
+        await super().leave_chat(chat_id, phone, websocket)
+        if not self.hub.in_chat(chat_id, phone):
+            await realtime_presence.delete_one({"chat_id": chat_id, "phone": phone, "worker_id": self.worker_id})
+
+    async def is_in_chat(self, chat_id: str, phone: str) -> bool:
+        if self.hub.in_chat(chat_id, phone):
+            return True
+        return await realtime_presence.find_one({"chat_id": chat_id, "phone": phone}, {"_id": 1}) is not None
+
+    async def _tail(self):
+        # Start after the newest published number so history is not replayed
+        counter = await counters.find_one({"_id": "realtime_events"})
+        # Every event up to `complete` was seen; `seen` holds the ones seen beyond it
+        complete = counter["value"] if counter else 0
+        seen = set()
+        while True:
+            try:
+                # One awaitable cursor for as long as it lives; the server waits for new events.
+                # The last complete event is matched again so the cursor does not start out empty and die.
+                cursor = realtime_events.find({"seq": {"$gte": complete}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for event in cursor:
+                        seq = event["seq"]
+                        if seq <= complete or seq in seen:
+                            continue
+                        seen.add(seq)
+                        while complete + 1 in seen or len(seen) > REALTIME_SEQ_WINDOW:
+                            complete += 1
+                            seen.discard(complete)
+                        if event.get("origin") == self.worker_id:
+                            continue
+                        if event["channel"] == "chat":
+                            await self.hub.deliver_chat(event["key"], event["message"])
+                        elif event["channel"] == "notification":
+                            await self.hub.deliver_notification(event["key"], event["message"])
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                print(f"[BROKER] event tail error, reconnecting: {e}")
+            await asyncio.sleep(1)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(PRESENCE_HEARTBEAT)
+            try:
+                await realtime_presence.update_many(
+                    {"worker_id": self.worker_id},
+                    {"$set": {"seen_at": datetime.utcnow()}}
+                )
+            except PyMongoError as e:
+                print(f"[BROKER] presence heartbeat failed: {e}")
+
+
+def create_broker(hub: ConnectionHub):
+    if REALTIME_BROKER == "mongo":
+        return MongoBroker(hub)
+    return InMemoryBroker(hub)
+
+
+hub = ConnectionHub()
+
+broker = create_broker(hub)
@@ -0,0 +1,59 @@
+import asyncio
+
+
+def digest_message(messages: list) -> dict:
+    """
+    Merges pending new_message notifications into one frame.
+
+    A single notification is passed through unchanged, so clients only see the
+    digest format when something was actually coalesced.
+    """
+    if len(messages) == 1:
+        return messages[0]
+    by_task = {}
+    for message in messages:
+        task = by_task.setdefault(message.get("task_id"), {"task_id": message.get("task_id"), "count": 0, "from_phones": []})
+        task["count"] += 1
+        if message.get("from_phone") not in task["from_phones"]:
+            task["from_phones"].append(message.get("from_phone"))
+    return {
+        "type": "digest",
+        "count": len(messages),
+        "tasks": list(by_task.values()),
+        "created_at": messages[-1].get("created_at")
+    }
+
+
+class DigestBuffer:
+    """
+    Per-recipient coalescing windows for notification frames.
+
+    The first notification for a phone is flushed right away and opens a
+    window of the recipient's length; everything arriving before it closes
+    is flushed as one digest when it closes, which opens the next window.
+    A window that closes with nothing pending ends the burst. A window of 0
+    flushes immediately.
+    """
+
+    def __init__(self, flush):
+        self._flush = flush
+        self._pending = {}
+
+    def add(self, phone: str, message: dict, window: float):
+        if window <= 0:
+            self._flush(phone, message)
+            return
+        pending = self._pending.get(phone)
+        if pending is None:
+            self._pending[phone] = []
+            asyncio.get_running_loop().call_later(window, self._flush_pending, phone, window)
+            self._flush(phone, message)
+            return
+        pending.append(message)
+
+    def _flush_pending(self, phone: str, window: float):
+        messages = self._pending.pop(phone, None)
+        if messages:
+            self._pending[phone] = []
+            asyncio.get_running_loop().call_later(window, self._flush_pending, phone, window)
+            self._flush(phone, digest_message(messages))
@@ -0,0 +1,85 @@
+from fastapi import WebSocket
+from collections import deque
+import asyncio
+import os
+
+# Messages a socket may have waiting before OUTBOUND_POLICY applies
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "64"))
+
+# What to do when a socket's queue is full: drop_oldest, coalesce or disconnect
+OUTBOUND_POLICY = os.getenv("OUTBOUND_POLICY", "coalesce")
+
+# A single send taking longer than this marks the client as dead
+OUTBOUND_SEND_TIMEOUT = float(os.getenv("OUTBOUND_SEND_TIMEOUT", "10"))
+
+
+def notification_key(message: dict):
+    # Notifications about the same chat may replace each other when a client falls behind
+    return f"{message.get('type')}:{message.get('task_id')}:{message.get('from_phone')}"
+
+
+class OutboundSocket:
+    """
+    A WebSocket with its own bounded send queue and writer task.
+
+    send() never blocks the caller, so one slow client cannot stall a broadcast
+    or the sender's receive loop. When the queue is full the configured policy
+    drops the oldest message, replaces a queued message with the same coalescing
+    key (falling back to dropping the oldest), or disconnects the client.
+    Dead clients are detected by the server's protocol-level WebSocket pings
+    (uvicorn --ws-ping-interval/--ws-ping-timeout) and by send timeouts.
+    """
+
+    def __init__(self, websocket: WebSocket, maxsize: int = OUTBOUND_QUEUE_SIZE, policy: str = OUTBOUND_POLICY):
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.closed = False
+        self.dropped = 0
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def send(self, message: dict, key=None):
+        if self.closed:
+            return
+        if len(self._queue) >= self.maxsize:
+            if self.policy == "disconnect":
+                asyncio.create_task(self.close(code=1013))
+                return
+            if self.policy == "coalesce" and key is not None:
+                for i, (queued_key, _) in enumerate(self._queue):
+                    if queued_key == key:
+                        self._queue[i] = (key, message)
+                        self.dropped += 1
+                        return
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append((key, message))
+        self._ready.set()
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue and not self.closed:
+                    _, message = self._queue.popleft()
+                    await asyncio.wait_for(self.websocket.send_json(message), OUTBOUND_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[OUTBOUND] closing slow or broken socket: {e}")
+            await self.close()
+
+    async def close(self, code: int = 1011):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
@@ -1,13 +1,13 @@
 
 from fastapi import APIRouter, HTTPException, status, Depends, Request, Body, WebSocket, WebSocketDisconnect
-from db.dbconn import users_collections, groups, tasks, completedtasks, fs, comments, chat_read_state, telegram_users
-from db.hash import Hash
+from db.dbconn import users_collections, groups, tasks, task_series, completedtasks, task_tombstones, fs, comments, chat_read_state, conversation_summaries, telegram_users, telegram_outbox, telegram_link_tokens
+from db.hash import async_hash
 from typing import Dict
 from jose import jwt
 from fastapi.encoders import jsonable_encoder
 import os
-from shemas.users import UserLogin, UserRegister, DeleteUserRequest, GroupCreateRequest, DeleteGroupRequest, UserEdit, GroupEdit, Task, TaskTime,TaskTimeCancel, TaskEdit, GroupCreateRequest2, GroupCreateRequest3, TaskRequest, QuestionTaskRequest, ChatReadRequest
-from middelware.auth import auth_middleware_status_return, verify_admin_token, auth_middleware_phone_return
+from shemas.users import UserLogin, UserRegister, DeleteUserRequest, GroupCreateRequest, DeleteGroupRequest, UserEdit, GroupEdit, Task, TaskTime,TaskTimeCancel, TaskEdit, GroupCreateRequest2, GroupCreateRequest3, TaskRequest, QuestionTaskRequest, ChatReadRequest, NotificationSettings
+from middelware.auth import auth_middleware_status_return, verify_admin_token, auth_middleware_phone_return, resolve_principal
 from bson import ObjectId
 from io import BytesIO
 from datetime import datetime
@@ -18,16 +18,34 @@ from fastapi.responses import StreamingResponse
 import io
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
+from jose.exceptions import ExpiredSignatureError, JWTError
 from urllib.parse import unquote
 from fastapi import Form, File, UploadFile, Request, Depends
 from typing import List
 import json
 import gridfs
-from telegramfiles.startpage import bot
+from telegramfiles.outbox import enqueue_digest, outbox_dispatcher
+from telegramfiles.startpage import application
+import secrets
+from db.migrations import parse_client_time, finish_at_stages
+from db.pagination import encode_cursor, decode_cursor, keyset_after
+from typing import Optional
+from db.task_series import SERIES_TASK_TYPES, OCCURRENCE_FIELDS, DEFAULT_OCCURRENCE_WINDOW_DAYS, series_days, expand_series, find_occurrences, get_occurrence, parse_occurrence_id
+from db.group_directory import group_directory
+from db.user_directory import user_directory, public_profile, notification_window
+from db.group_commit import comment_writer
+from db.photos import store_photos, variant_file_id, PHOTO_VARIANTS
+from db.blobstore import blob_response
+from db.conversations import record_message, mark_conversation_read, conversation_id
+from db.sync import sync_stamp, record_tombstones, tombstone_group_for, resend_group, current_sync_version, SYNC_VERSION_OVERLAP
+from realtime.broker import broker, hub
+from realtime.outbound import OutboundSocket
 
 user_app = APIRouter()  
 
+# Lifetime of a Telegram /start link in seconds
+TELEGRAM_LINK_TTL = int(os.getenv("TELEGRAM_LINK_TTL", "900"))
+
 @user_app.post("/login")
 async def login_user(user: UserLogin):
     """
@@ -61,7 +79,7 @@ async def login_user(user: UserLogin):
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="User not found"
             )
-        if not Hash.verify(user.password, found_user["password"]):
+        if not await async_hash.verify(user.password, found_user["password"]):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid credentials"
@@ -76,6 +94,8 @@ async def login_user(user: UserLogin):
             algorithm='HS256'
         )
         return {"token": token}
+    except HTTPException:
+        raise
     except Exception as e:
         print(e)
         raise HTTPException(
@@ -104,14 +124,16 @@ async def login_user(token:str):
         "admin"
     """
     try:
-        payload = jwt.decode(token, os.getenv("SecretJwt"), algorithms=["HS256"])
+        payload = resolve_principal(token)
         user_status = payload.get("status")
         if not user_status:
             raise HTTPException(status_code=400, detail="User status not found in token")
         return str(user_status)
+    except HTTPException:
+        raise
     except ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except InvalidTokenError:
+    except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal server error during token decoding")
@@ -150,11 +172,12 @@ async def register_user(request: Request, user: UserRegister):
             detail="User already exists"
         )
 
-    hashed_password = Hash.bcrypt(user.password)
+    hashed_password = await async_hash.bcrypt(user.password)
     user.password = hashed_password
 
     try:
         await users_collections.insert_one(user.dict())
+        user_directory.invalidate(user.phone)
     except PyMongoError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -174,7 +197,7 @@ async def get_task(task_id: str):
     Retrieves a specific task by its ID.
     
     Args:
-        task_id (str): MongoDB ObjectId of the task
+        task_id (str): MongoDB ObjectId of the task or occurrence id of a task series
         
     Returns:
         dict: Task details
@@ -193,6 +216,21 @@ async def get_task(task_id: str):
             ...
         }
     """
+    if parse_occurrence_id(task_id):
+        try:
+            task = await get_occurrence(task_id)
+        except PyMongoError as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Помилка при зверненні до бази даних"
+            )
+        if not task:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Завдання не знайдено"
+            )
+        return task
+
     try:
         obj_id = ObjectId(task_id)
     except Exception:
@@ -254,41 +292,23 @@ async def get_tasks_by_group(start_date: str, end_date: str, phone=Depends(auth_
     except ValueError:
         raise HTTPException(status_code=400, detail="Неправильний формат дати. Використовуйте YYYY-MM-DD")
 
-    query = {
-        "phone": phone,
-        "finish_time": {"$exists": True}
-    }
+    pipeline = [
+        *await finish_at_stages({"phone": phone}, {"$gte": start_dt, "$lte": end_dt}),
+        {"$sort": {"finish_at": -1, "_id": -1}},
+        {"$addFields": {"_id": {"$toString": "$_id"}}},
+        {"$group": {
+            "_id": {"$ifNull": ["$group", "Без групи"]},
+            "total_active_minutes": {"$sum": "$active_minutes"},
+            "tasks": {"$push": "$$ROOT"}
+        }}
+    ]
 
     try:
-        tasks_cursor = completedtasks.find(query)
+        grouped = await completedtasks.aggregate(pipeline).to_list(length=None)
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail="Помилка бази даних")
 
-    grouped_tasks = {}
-
-    async for task in tasks_cursor:
-        try:
-            finish_time = datetime.strptime(task["finish_time"], "%d.%m.%Y, %H:%M:%S")
-        except (ValueError, KeyError):
-            continue  
-
-        if start_dt <= finish_time <= end_dt:
-            group = task.get("group", "Без групи")
-            task["_id"] = str(task["_id"])
-            task["__parsed_finish_time"] = finish_time
-            grouped_tasks.setdefault(group, []).append(task)
-
-    result = {}
-    for group, tasks in grouped_tasks.items():
-        sorted_tasks = sorted(tasks, key=lambda x: x["__parsed_finish_time"], reverse=True)
-
-        for t in sorted_tasks:
-            del t["__parsed_finish_time"]  
-            total_active_minutes = sum(t.get("active_minutes", 0) or 0 for t in sorted_tasks)
-            
-        result[group] = [total_active_minutes] + sorted_tasks
-
-    return result
+    return {item["_id"]: [item["total_active_minutes"]] + item["tasks"] for item in grouped}
 
 @user_app.post("/tasks_by_group2")
 async def get_tasks_by_group(request: TaskRequest, phone=Depends(auth_middleware_phone_return)):
@@ -321,7 +341,7 @@ async def get_tasks_by_group(request: TaskRequest, phone=Depends(auth_middleware
         ]
     """
     try:
-        phone_group = await groups.find_one({"group_name": request.group}, {"manager_phone": 1})
+        phone_group = await group_directory.get(request.group)
         if phone_group["manager_phone"] != phone:
             raise HTTPException(status_code=403, detail="У вас немає прав для виконання цієї задачі")
     except Exception:
@@ -332,32 +352,190 @@ async def get_tasks_by_group(request: TaskRequest, phone=Depends(auth_middleware
     except ValueError:
         raise HTTPException(status_code=400, detail="Неправильний формат дати")
 
-    query = {
-        "group": request.group,
-        "finish_time": {"$exists": True}
-    }
+    stages = await finish_at_stages({"group": request.group}, {"$gte": start_dt, "$lte": end_dt})
 
-    tasks_cursor = completedtasks.find(query)
+    tasks_cursor = completedtasks.aggregate([*stages, {"$sort": {"finish_at": -1}}])
 
     result = []
     total_active_minutes = 0  
 
     async for task in tasks_cursor:
-        try:
-            finish_time = datetime.strptime(task["finish_time"], "%d.%m.%Y, %H:%M:%S")
-        except Exception:
-            continue
+        task["_id"] = str(task["_id"])
+        active_minutes = task.get("active_minutes")
+        if isinstance(active_minutes, (int, float)):
+            total_active_minutes += active_minutes
 
-        if start_dt <= finish_time <= end_dt:
-            task["_id"] = str(task["_id"])
-            active_minutes = task.get("active_minutes")
-            if isinstance(active_minutes, (int, float)):
-                total_active_minutes += active_minutes
-
-            result.append(task)
+        result.append(task)
     result2 = [total_active_minutes] + result
     return result2
 
+COMPLETIONS_PAGE_SORT = [("finish_at", -1), ("_id", -1)]
+
+async def completions_page(stages: list, cursor: Optional[str], limit: int, summary_key):
+    """
+    Runs one aggregation returning a keyset page of completions sorted by finish time.
+
+    `stages` select the completions (see finish_at_stages).
+
+    The first page (no cursor) also carries a summary block with the number of
+    completions and the `$sum` of active minutes per `summary_key`.
+    """
+    limit = max(1, min(limit, 200))
+    page_stages = [
+        {"$sort": dict(COMPLETIONS_PAGE_SORT)},
+        {"$limit": limit + 1},
+        {"$addFields": {"_id": {"$toString": "$_id"}, "_cursor": ["$finish_at", "$_id"]}}
+    ]
+
+    if cursor:
+        try:
+            after = keyset_after(COMPLETIONS_PAGE_SORT, decode_cursor(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        pipeline = stages + [{"$match": after}] + page_stages
+        page = await completedtasks.aggregate(pipeline).to_list(length=None)
+        summary = None
+    else:
+        pipeline = stages + [
+            {"$facet": {
+                "tasks": page_stages,
+                "summary": [{"$group": {
+                    "_id": summary_key,
+                    "total_active_minutes": {"$sum": "$active_minutes"},
+                    "count": {"$sum": 1}
+                }}]
+            }}
+        ]
+        facets = (await completedtasks.aggregate(pipeline).to_list(length=None))[0]
+        page = facets["tasks"]
+        summary = {
+            item["_id"]: {"total_active_minutes": item["total_active_minutes"], "count": item["count"]}
+            for item in facets["summary"]
+        }
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1]["_cursor"])
+    for task in page:
+        del task["_cursor"]
+
+    return {"summary": summary, "tasks": page, "next_cursor": next_cursor}
+
+@user_app.post("/tasks_by_group/page")
+async def get_tasks_by_group_page(
+    start_date: str,
+    end_date: str,
+    group: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    phone=Depends(auth_middleware_phone_return)
+):
+    """
+    Retrieves the authenticated user's completed tasks within a date range, one page at a time.
+    
+    Args:
+        start_date (str): Start date in YYYY-MM-DD format
+        end_date (str): End date in YYYY-MM-DD format
+        group (str): Optional group name to restrict the page to
+        cursor (str): `next_cursor` of the previous page, omitted for the first page
+        limit (int): Page size (1-200)
+        phone (str): Authenticated user's phone (from dependency)
+        
+    Returns:
+        dict: Page of tasks sorted by finish time, per-group totals on the first page
+        
+    Raises:
+        HTTPException: 400 for invalid date format or cursor
+        
+    Example Request:
+        POST /tasks_by_group/page?start_date=2023-01-01&end_date=2023-01-31&limit=50
+        
+    Example Response:
+        {
+            "summary": {
+                "Group1": {"total_active_minutes": 450, "count": 12},
+                "Group2": {...}
+            },
+            "tasks": [{task1...}, {task2...}],
+            "next_cursor": "W3siJGRhdGUiOi..."
+        }
+    """
+    try:
+        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+        end_dt = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1) - timedelta(seconds=1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неправильний формат дати. Використовуйте YYYY-MM-DD")
+
+    match = {"phone": phone}
+    if group is not None:
+        match["group"] = group
+    stages = await finish_at_stages(match, {"$gte": start_dt, "$lte": end_dt})
+
+    try:
+        return await completions_page(stages, cursor, limit, {"$ifNull": ["$group", "Без групи"]})
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail="Помилка бази даних")
+
+@user_app.post("/tasks_by_group2/page")
+async def get_tasks_by_group2_page(
+    request: TaskRequest,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    phone=Depends(auth_middleware_phone_return)
+):
+    """
+    Retrieves completed tasks for a specific group within a date range, one page at a time (manager-only).
+    
+    Args:
+        request (TaskRequest): Contains start_date, end_date, and group name
+        cursor (str): `next_cursor` of the previous page, omitted for the first page
+        limit (int): Page size (1-200)
+        phone (str): Authenticated manager's phone (from dependency)
+        
+    Returns:
+        dict: Page of tasks sorted by finish time, group totals on the first page
+        
+    Raises:
+        HTTPException: 403 if not group manager, 404 if group not found, 400 for invalid dates or cursor
+        
+    Example Request:
+        POST /tasks_by_group2/page?limit=50
+        {
+            "start_date": "2023-01-01",
+            "end_date": "2023-01-31",
+            "group": "Development"
+        }
+        
+    Example Response:
+        {
+            "summary": {"total_active_minutes": 450, "count": 12},
+            "tasks": [{task1 data...}, {task2 data...}],
+            "next_cursor": null
+        }
+    """
+    phone_group = await group_directory.get(request.group)
+    if not phone_group:
+        raise HTTPException(status_code=404, detail="Група не знайдена")
+    if phone_group["manager_phone"] != phone:
+        raise HTTPException(status_code=403, detail="У вас немає прав для виконання цієї задачі")
+    try:
+        start_dt = datetime.strptime(request.start_date, "%Y-%m-%d")
+        end_dt = datetime.strptime(request.end_date, "%Y-%m-%d") + timedelta(days=1) - timedelta(seconds=1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неправильний формат дати")
+
+    stages = await finish_at_stages({"group": request.group}, {"$gte": start_dt, "$lte": end_dt})
+
+    try:
+        page = await completions_page(stages, cursor, limit, None)
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail="Помилка бази даних")
+
+    if page["summary"] is not None:
+        page["summary"] = page["summary"].get(None, {"total_active_minutes": 0, "count": 0})
+    return page
+
 @user_app.get("/get_users", dependencies=[Depends(verify_admin_token)])
 async def get_users(request: Request):
     """
@@ -425,10 +603,14 @@ async def delete_user(request: Request, user: DeleteUserRequest):
 
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Користувача не знайдено")
+        user_directory.invalidate(user.phone)
 
         tasks_for_delete = []
-        async for group in groups.find({"manager_phone": user.phone}, {'_id': 0, 'group_name': 1}):
+        # Members of the deleted groups must still receive the tombstones
+        affected_phones = set()
+        async for group in groups.find({"manager_phone": user.phone}, {'_id': 0, 'group_name': 1, 'user_phones': 1}):
             tasks_for_delete.append(group['group_name'])
+            affected_phones.update(group.get('user_phones', []))
 
         await groups.delete_many({"manager_phone": user.phone})
 
@@ -436,11 +618,19 @@ async def delete_user(request: Request, user: DeleteUserRequest):
             {"user_phones": {"$in": [user.phone]}},
             {"$pull": {"user_phones": user.phone}}
         )
+        group_directory.invalidate()
 
         if tasks_for_delete:
-            await tasks.delete_many({'group': {"$in": tasks_for_delete}})
+            deleted_filter = {'group': {"$in": tasks_for_delete}}
+            projection = {"_id": 1, "group": 1, "created_by": 1}
+            await record_tombstones(await tasks.find(deleted_filter, projection).to_list(length=None), phones=affected_phones)
+            await record_tombstones(await task_series.find(deleted_filter, projection).to_list(length=None), series=True, phones=affected_phones)
+            await tasks.delete_many(deleted_filter)
+            await task_series.delete_many(deleted_filter)
         return {"message": "Користувача успішно видалено"}
 
+    except HTTPException:
+        raise
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail="Помилка бази даних")
 
@@ -471,13 +661,25 @@ async def delete_group(request: Request, group: DeleteGroupRequest):
         {"message": "Group successfully deleted"}
     """
     try:
-        result = await groups.delete_one({"group_name": group.group_name})
+        deleted_group = await groups.find_one_and_delete({"group_name": group.group_name})
 
-        if result.deleted_count == 0:
+        if deleted_group is None:
             raise HTTPException(status_code=404, detail="Group not found")
-
-        await tasks.delete_many({'group': group.group_name})
-        
+        group_directory.invalidate()
+
+        # The group leaves its members' sync scope, so address the tombstones to them directly
+        affected_phones = set(deleted_group.get("user_phones", []))
+        if deleted_group.get("manager_phone"):
+            affected_phones.add(deleted_group["manager_phone"])
+        deleted_filter = {'group': group.group_name}
+        projection = {"_id": 1, "group": 1, "created_by": 1}
+        await record_tombstones(await tasks.find(deleted_filter, projection).to_list(length=None), phones=affected_phones)
+        await record_tombstones(await task_series.find(deleted_filter, projection).to_list(length=None), series=True, phones=affected_phones)
+        await tasks.delete_many(deleted_filter)
+        await task_series.delete_many(deleted_filter)
+        
+    except HTTPException:
+        raise
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail="Помилка бази даних")
 
@@ -587,6 +789,7 @@ async def create_group(group: GroupCreateRequest):
             "active": 1
         }
         await groups.insert_one(group_data)
+        group_directory.invalidate()
         return {"message": "Group successfully created"}
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail="Помилка бази даних")
@@ -631,7 +834,7 @@ async def get_users_info_group(
         }
     """
     try:
-        group_data = await groups.find_one({"group_name": group.group_name})
+        group_data = await group_directory.get(group.group_name)
         if not group_data:
             raise HTTPException(status_code=404, detail="Group not found")
         if group_data["manager_phone"] != phone:
@@ -680,10 +883,10 @@ async def get_users_info_group2(
         }
     """
     try:
-        result = {}
+        managed_groups = {}
 
         for group_name in groups_req.groups_names:
-            group_data = await groups.find_one({"group_name": group_name})
+            group_data = await group_directory.get(group_name)
             
             if not group_data:
                 continue 
@@ -691,15 +894,18 @@ async def get_users_info_group2(
             if group_data["manager_phone"] != phone:
                 continue  
 
-            user_phones = group_data.get("user_phones", [])
-            
-            cursor = users_collections.find(
-                {"phone": {"$in": user_phones}},
-                {"password": 0, "_id": 0, "status": 0}
-            )
-            users = await cursor.to_list(length=None)
-            
-            result[group_name] = users
+            managed_groups[group_name] = group_data.get("user_phones", [])
+
+        # Resolve the members of all requested groups in one batch
+        profiles = await user_directory.get_many(
+            member for user_phones in managed_groups.values() for member in user_phones
+        )
+        result = {}
+        for group_name, user_phones in managed_groups.items():
+            result[group_name] = [
+                public_profile(profiles[member], exclude=("_id", "status"))
+                for member in user_phones if member in profiles
+            ]
         
         return result
     except PyMongoError as e:
@@ -709,34 +915,37 @@ async def get_users_info_group2(
         raise HTTPException(status_code=500, detail="Невідома помилка сервера")
 
 @user_app.get("/download_file/{file_id}")
-async def download_file(file_id: str):
+async def download_file(request: Request, file_id: str, size: Optional[str] = None):
     """
     Downloads a file by its ID.
     
     Args:
-        file_id (str): MongoDB GridFS file ID
+        file_id (str): Blob ID (GridFS or local storage)
+        size (str, optional): Downscaled photo variant to return ("thumb" or "review");
+            the original is returned if omitted or if the photo has no variants
         
     Returns:
-        StreamingResponse: File download stream
+        StreamingResponse: File download stream; 206 for a `Range` request,
+            304 if `If-None-Match` matches the file's ETag
         
     Raises:
-        HTTPException: 400 for invalid ID, 404 if file not found
+        HTTPException: 400 for invalid ID or size, 404 if file not found,
+            416 if the requested range is outside the file
         
     Example Request:
-        GET /download_file/507f1f77bcf86cd799439011
+        GET /download_file/507f1f77bcf86cd799439011?size=thumb
         
     Response:
-        Binary file stream with Content-Disposition header
+        Binary file stream with the stored content type, Content-Length,
+        ETag, Cache-Control: immutable and Content-Disposition headers
     """
-    try:
-        file_object_id = ObjectId(file_id)  
-    except Exception as e:
+    if not ObjectId.is_valid(file_id):
         raise HTTPException(status_code=400, detail="Invalid file ID format")
-    try:
-        file_stream = await fs.open_download_stream(file_object_id)
-    except gridfs.errors.NoFile:
-        raise HTTPException(status_code=404, detail="File not found")
-    return StreamingResponse(file_stream, media_type="image/jpeg", headers={"Content-Disposition": f"attachment;"})
+    if size is not None:
+        if size not in PHOTO_VARIANTS:
+            raise HTTPException(status_code=400, detail=f"Unknown size, expected one of: {', '.join(PHOTO_VARIANTS)}")
+        file_id = await variant_file_id(file_id, size)
+    return await blob_response(request, file_id)
 
 @user_app.get("/get_groups/", dependencies=[Depends(verify_admin_token)])
 async def get_groups(request: Request):
@@ -809,7 +1018,7 @@ async def edit_user(request: Request, user: UserEdit):
         if user.name:
             update_data["name"] = user.name
         if user.password:
-            update_data["password"] = Hash.bcrypt(user.password)
+            update_data["password"] = await async_hash.bcrypt(user.password)
         if user.status is not None: 
             update_data["status"] = user.status
         if user.telegramName: 
@@ -825,8 +1034,12 @@ async def edit_user(request: Request, user: UserEdit):
 
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
+        # The request only carries the user id, so drop every cached profile
+        user_directory.invalidate()
 
         return {"message": "User updated successfully"}
+    except HTTPException:
+        raise
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail="Помилка бази даних")
 
@@ -871,15 +1084,31 @@ async def edit_group(request: Request, user: GroupEdit):
         if not update_data:
             raise HTTPException(status_code=400, detail="No valid fields to update")
 
-        result = await groups.update_one(
+        previous = await groups.find_one_and_update(
             {"group_name": user.group_name},
-            {"$set": update_data}
+            {"$set": update_data},
+            projection={"user_phones": 1, "active": 1}
         )
 
-        if result.matched_count == 0:
+        if previous is None:
             raise HTTPException(status_code=404, detail="Group not found")
+        group_directory.invalidate()
+
+        # Keep delta sync in step with who can see the group's tasks
+        old_phones = set(previous.get("user_phones", []))
+        new_phones = set(update_data.get("user_phones", old_phones))
+        was_active = previous.get("active") == 1
+        is_active = update_data["active"] == 1
+        if was_active and not is_active:
+            await tombstone_group_for(user.group_name, old_phones | new_phones)
+        elif is_active:
+            await tombstone_group_for(user.group_name, old_phones - new_phones)
+            if not was_active or new_phones - old_phones:
+                await resend_group(user.group_name)
 
         return {"message": "Group updated successfully"}
+    except HTTPException:
+        raise
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail="Помилка бази даних")
 
@@ -914,11 +1143,7 @@ async def login_user(request: Request, start_date: str, end_date: str, phone = D
         }
     """
     try:
-        users_group4 = await groups.find(
-            {"active": 1},
-            {"_id": 0, "group_name": 1, "user_phones": 1}
-        ).to_list(length=None)
-        users_group = {item["group_name"]: item["user_phones"] for item in users_group4}
+        users_group = await group_directory.active_groups()
         groups_user2 = dict()
 
         pipeline = [
@@ -949,35 +1174,15 @@ async def login_user(request: Request, start_date: str, end_date: str, phone = D
             e = list()
             e.append(doc['total_tasks'])
             groups_user[doc['_id']] = e
+        for occurrence in await find_occurrences({"created_by": phone}, start_date, end_date):
+            groups_user.setdefault(occurrence["group"], [0])[0] += 1
         start_date = datetime.strptime(start_date, "%Y-%m-%d")
         end_date = datetime.strptime(end_date, "%Y-%m-%d")
         start_date = datetime.combine(start_date, datetime.min.time())  
         end_date = datetime.combine(end_date, datetime.max.time())
         
         pipeline = [
-            {
-                "$match": {
-                    "status": 1,  
-                }
-            },
-            {
-                "$addFields": {
-                    "finish_time_parsed": {
-                        "$dateFromString": {
-                            "dateString": "$finish_time",  
-                            "format": "%d.%m.%Y, %H:%M:%S"  
-                        }
-                    }
-                }
-            },
-            {
-                "$match": {
-                    "finish_time_parsed": {
-                        "$gte": start_date,  
-                        "$lt": end_date      
-                    }
-                }
-            },
+            *await finish_at_stages({"status": 1}, {"$gte": start_date, "$lt": end_date}),
             {
                 "$group": {
                     "_id": {
@@ -1291,9 +1496,7 @@ async def login_user(request: Request, phone = Depends(auth_middleware_phone_ret
         ["Development", "Design"]
     """
     try:
-        results = await groups.find({"manager_phone": phone}, {"group_name": 1, "_id": 0}).to_list(length=None)
-        results2 = [i["group_name"] for i in results]
-        return results2
+        return await group_directory.managed_by(phone)
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail="Помилка бази даних")
 
@@ -1335,7 +1538,10 @@ async def get_info(request: Request, phone = Depends(auth_middleware_phone_retur
 @user_app.post("/tasks")
 async def create_task(request: Request, task: Task, phone=Depends(auth_middleware_phone_return)):
     """
-    Creates one or multiple tasks based on task type (general, weekly, or single).
+    Creates a task based on task type (general, weekly, or single).
+
+    General and weekly tasks are stored once as a task series (recurrence rule)
+    whose daily occurrences are expanded when tasks are read.
     
     Args:
         task (Task): Task creation data
@@ -1368,8 +1574,8 @@ async def create_task(request: Request, task: Task, phone=Depends(auth_middlewar
         {"message": "104 tasks successfully saved to database"}
     """
     try:
-        result = await groups.find_one({"group_name": task.group}, {"manager_phone": 1, "_id": 0})
-        user_info = await users_collections.find_one({'phone': phone}, {'name': 1})
+        result = await group_directory.get(task.group)
+        user_info = await user_directory.get(phone)
 
         if not result or result["manager_phone"] != phone:
             raise HTTPException(status_code=404, detail="У вас немає прав для виконання цієї задачі")
@@ -1382,47 +1588,36 @@ async def create_task(request: Request, task: Task, phone=Depends(auth_middlewar
             start_date = datetime.strptime(task.startDate, "%Y-%m-%d")
             end_date = datetime.strptime(task.endDate, "%Y-%m-%d")
 
-            days_to_create = []
-
-            if task_type == "general":
-                current = start_date
-                while current <= end_date:
-                    days_to_create.append(current)
-                    current += timedelta(days=1)
+            task_data = {
+                "title": task.title,
+                "description": task.description,
+                "start_date": start_date.strftime("%Y-%m-%d"),
+                "end_date": end_date.strftime("%Y-%m-%d"),
+                "start_time": task.startTime,
+                "end_time": task.endTime,
+                "repeat_days": task.repeatDays,
+                "group": task.group,
+                "task_type": task.taskType,
+                "importance": int(task.importance),
+                "created_by": phone,
+                'needphoto': task.needphoto,
+                'needcomment': task.needcomment,
+                'openquestion': task.openquestion,
+                "created_name": user_info['name']
+            }
+            task_data.update(await sync_stamp())
 
-            elif task_type == "weekly":
-                repeat_days = task.repeatDays  
-                weekday_indices = [list(calendar.day_name).index(day) for day in repeat_days]
+            if task_type in SERIES_TASK_TYPES:
+                occurrences_count = len(series_days(task_data))
+                if occurrences_count:
+                    task_data["overrides"] = {}
+                    await task_series.insert_one(task_data)
+                return {"message": f"{occurrences_count} tasks successfully saved to database"}
 
-                current = start_date
-                while current <= end_date:
-                    if current.weekday() in weekday_indices:
-                        days_to_create.append(current)
-                    current += timedelta(days=1)
-            else:
-                days_to_create = [start_date]
-
-            for day in days_to_create:
-                task_data = {
-                    "title": task.title,
-                    "description": task.description,
-                    "start_date": day.strftime("%Y-%m-%d"),
-                    "end_date": day.strftime("%Y-%m-%d"),
-                    "start_time": task.startTime,
-                    "end_time": task.endTime,
-                    "repeat_days": task.repeatDays,
-                    "group": task.group,
-                    "task_type": task.taskType,
-                    "importance": int(task.importance),
-                    "created_by": phone,
-                    'needphoto': task.needphoto,
-                    'needcomment': task.needcomment,
-                    'openquestion': task.openquestion,
-                    "created_name": user_info['name']
-                }
-                await tasks.insert_one(task_data)
+            task_data["end_date"] = task_data["start_date"]
+            await tasks.insert_one(task_data)
 
-            return {"message": f"{len(days_to_create)} tasks successfully saved to database"}
+            return {"message": "1 tasks successfully saved to database"}
 
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to save task: {str(e)}")
@@ -1433,39 +1628,73 @@ async def create_task(request: Request, task: Task, phone=Depends(auth_middlewar
         raise HTTPException(status_code=500, detail="Невідома помилка сервера")
 
 @user_app.get("/get_my_task")
-async def get_tasks(request: Request, phone=Depends(auth_middleware_phone_return)):
+async def get_tasks(
+    request: Request,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    phone=Depends(auth_middleware_phone_return)
+):
     """
     Retrieves tasks assigned to authenticated user's groups.
     
+    Recurring tasks are expanded into their occurrences within the window
+    (DEFAULT_OCCURRENCE_WINDOW_DAYS days from today, or from/to the given
+    day, when a bound is omitted); each occurrence carries the user's
+    `completion`. The appended list holds the IDs of the returned tasks the
+    user has completed.
+    
     Args:
+        start_date (str): Optional first day (YYYY-MM-DD) of recurring task occurrences to expand
+        end_date (str): Optional last day (YYYY-MM-DD) of recurring task occurrences to expand
         phone (str): Authenticated user's phone (from dependency)
         
     Returns:
         list: Tasks sorted by importance with completed task IDs appended
         
+    Raises:
+        HTTPException: 400 for invalid date format
+        
     Example Request:
-        GET /get_my_task
+        GET /get_my_task?start_date=2023-01-01&end_date=2023-01-31
         
     Example Response:
         [
             {task1 data...},
-            {task2 data...},
+            {occurrence data..., "completion": {"status": 1, "finish_at": "2023-01-02T11:30:00"}},
             ["completed_task_id1", "completed_task_id2"]
         ]
     """
     try:
-        r = await groups.find({'user_phones': f"{phone}", 'active': 1}, {"group_name": 1, "_id": 0}).to_list(length=None)
-        compltasks = await completedtasks.find({"phone": f"{phone}"}, {"id_task": 1, "_id": 0}).to_list(length=None)
-        
-        tasksCompleteIDs = [task['id_task'] for task in compltasks]
-        
-        groups_name = [group["group_name"] for group in r]
+        first = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+        last = datetime.strptime(end_date, "%Y-%m-%d") if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неправильний формат дати. Використовуйте YYYY-MM-DD")
+    window = timedelta(days=DEFAULT_OCCURRENCE_WINDOW_DAYS)
+    if first is None:
+        first = last - window if last else datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    if last is None:
+        last = first + window
+    start_date, end_date = first.strftime("%Y-%m-%d"), last.strftime("%Y-%m-%d")
+
+    try:
+        groups_name = await group_directory.groups_of_member(phone)
         tasks_cursor = tasks.find({'group': {'$in': groups_name}}).sort([('importance', -1)])
         user_tasks = await tasks_cursor.to_list(length=None)
 
         for task in user_tasks:
             task["_id"] = str(task["_id"])
 
+        compltasks = await completedtasks.find(
+            {"phone": phone, "id_task": {"$in": [task["_id"] for task in user_tasks]}},
+            {"id_task": 1, "_id": 0}
+        ).to_list(length=None)
+        tasksCompleteIDs = [task['id_task'] for task in compltasks]
+
+        occurrences = await find_occurrences({'group': {'$in': groups_name}}, start_date, end_date, phone=phone)
+        tasksCompleteIDs.extend(o["_id"] for o in occurrences if o["completion"])
+        user_tasks.extend(occurrences)
+        user_tasks.sort(key=lambda t: t["importance"], reverse=True)
+
         user_tasks.append(tasksCompleteIDs)
         return user_tasks
     except PyMongoError as e:
@@ -1474,6 +1703,210 @@ async def get_tasks(request: Request, phone=Depends(auth_middleware_phone_return
     except Exception as e:
         raise HTTPException(status_code=500, detail="Невідома помилка сервера")
 
+FEED_SORT = [("importance", -1), ("start_date", 1), ("_id", 1)]
+
+def feed_sort_key(task: dict):
+    return (-task["importance"], task["start_date"], str(task["_id"]))
+
+@user_app.get("/get_my_task_feed")
+async def get_task_feed(
+    start_date: str,
+    end_date: str,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    phone=Depends(auth_middleware_phone_return)
+):
+    """
+    Retrieves one page of the tasks assigned to the authenticated user's groups within a date window.
+    
+    Tasks are ordered by importance (descending), start date and id. Each task
+    carries the user's own completion state, so the full list of completed
+    task IDs no longer has to be sent.
+    
+    Args:
+        start_date (str): First day of the window (YYYY-MM-DD)
+        end_date (str): Last day of the window (YYYY-MM-DD)
+        cursor (str): `next_cursor` of the previous page, omitted for the first page
+        limit (int): Page size (1-200)
+        phone (str): Authenticated user's phone (from dependency)
+        
+    Returns:
+        dict: Page of tasks and the cursor of the next page
+        
+    Raises:
+        HTTPException: 400 for invalid date format or cursor
+        
+    Example Request:
+        GET /get_my_task_feed?start_date=2023-01-01&end_date=2023-01-07&limit=50
+        
+    Example Response:
+        {
+            "tasks": [
+                {
+                    "_id": "507f1f77bcf86cd799439011",
+                    "title": "Code Review",
+                    ...,
+                    "completion": {"status": 1, "finish_at": "2023-01-02T11:30:00"}
+                },
+                {task2 data..., "completion": null}
+            ],
+            "next_cursor": "WzMsICIyMDIzLTAxLTAyIiwgey..."
+        }
+    """
+    try:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неправильний формат дати. Використовуйте YYYY-MM-DD")
+
+    limit = max(1, min(limit, 200))
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+            if (
+                len(after) != len(FEED_SORT)
+                or isinstance(after[0], bool) or not isinstance(after[0], (int, float))
+                or not isinstance(after[1], str)
+                or not isinstance(after[2], str) or not ObjectId.is_valid(after[2][:24])
+            ):
+                raise ValueError("Invalid cursor")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    try:
+        groups_name = await group_directory.groups_of_member(phone)
+
+        match = {'group': {'$in': groups_name}, 'start_date': {'$gte': start_date, '$lte': end_date}}
+        if after:
+            # Occurrence ids start with the series ObjectId, which orders the same way
+            match = {"$and": [match, keyset_after(FEED_SORT, [after[0], after[1], ObjectId(after[2][:24])])]}
+
+        pipeline = [
+            {"$match": match},
+            {"$sort": dict(FEED_SORT)},
+            {"$limit": limit + 1},
+            {"$addFields": {"_id": {"$toString": "$_id"}}},
+            {"$lookup": {
+                "from": completedtasks.name,
+                "localField": "_id",
+                "foreignField": "id_task",
+                "pipeline": [
+                    {"$match": {"phone": phone}},
+                    {"$project": {"_id": 0, "status": 1, "finish_at": 1}}
+                ],
+                "as": "completion"
+            }},
+            {"$addFields": {"completion": {"$arrayElemAt": ["$completion", 0]}}}
+        ]
+        page = await tasks.aggregate(pipeline).to_list(length=None)
+
+        # Occurrences of task series are expanded for the window only and merged into the page
+        occurrences = await find_occurrences({'group': {'$in': groups_name}}, start_date, end_date)
+        if after:
+            after_key = (-after[0], after[1], after[2])
+            occurrences = [o for o in occurrences if feed_sort_key(o) > after_key]
+        occurrences = sorted(occurrences, key=feed_sort_key)[:limit + 1]
+        if occurrences:
+            completions = await completedtasks.find(
+                {"phone": phone, "id_task": {"$in": [o["_id"] for o in occurrences]}},
+                {"_id": 0, "id_task": 1, "status": 1, "finish_at": 1}
+            ).to_list(length=None)
+            completed = {c.pop("id_task"): c for c in completions}
+            for occurrence in occurrences:
+                occurrence["completion"] = completed.get(occurrence["_id"])
+
+        page = sorted(page + occurrences, key=feed_sort_key)
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail="Помилка бази даних")
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = encode_cursor([last["importance"], last["start_date"], last["_id"]])
+
+    return {"tasks": page, "next_cursor": next_cursor}
+
+@user_app.get("/sync/tasks")
+async def sync_tasks(
+    since: int = 0,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    phone=Depends(auth_middleware_phone_return)
+):
+    """
+    Returns only the tasks and completions that changed since the client's version token.
+    
+    Covers the tasks of the user's active groups and the tasks the user created.
+    A client starts with since=0 (full snapshot), stores the returned `version`
+    and passes it back on the next sync. Tasks may be re-sent, so clients should
+    upsert them by `_id`.
+    
+    Args:
+        since (int): Version token returned by the previous sync, 0 for a full snapshot
+        start_date (str): Optional first day (YYYY-MM-DD) of recurring task occurrences to expand
+        end_date (str): Optional last day (YYYY-MM-DD) of recurring task occurrences to expand
+        phone (str): Authenticated user's phone (from dependency)
+        
+    Returns:
+        dict: Changed tasks, deleted task ids, changed completions and the new version token
+        
+    Example Request:
+        GET /sync/tasks?since=1718000000000000
+        
+    Example Response:
+        {
+            "version": 1718000042000000,
+            "full": false,
+            "tasks": [{task1 data...}, {occurrence data...}],
+            "replaced_series": ["507f191e810c19729de860ea"],
+            "deleted": [{"task_id": "507f1f77bcf86cd799439011", "series": false}],
+            "completions": [{"id_task": "507f1f77bcf86cd799439011", "status": 1, "finish_at": "2023-01-02T11:30:00"}]
+        }
+    """
+    try:
+        version = await current_sync_version()
+        groups_name = await group_directory.groups_of_member(phone)
+
+        scope = {"$or": [{"group": {"$in": groups_name}}, {"created_by": phone}]}
+        changed = {"sync_version": {"$gt": max(0, since - SYNC_VERSION_OVERLAP)}} if since > 0 else {}
+
+        changed_tasks = await tasks.find({**scope, **changed}).to_list(length=None)
+        for task in changed_tasks:
+            task["_id"] = str(task["_id"])
+
+        # A changed series is re-sent as the full set of its occurrences in the window
+        replaced_series = []
+        async for series in task_series.find({**scope, **changed}):
+            replaced_series.append(str(series["_id"]))
+            changed_tasks.extend(expand_series(series, start_date, end_date))
+
+        deleted = []
+        if since > 0:
+            # Tombstones addressed to the user cover groups they have left or that were deleted
+            tombstone_scope = {"$or": [*scope["$or"], {"phones": phone}]}
+            deleted = await task_tombstones.find(
+                {**tombstone_scope, **changed},
+                {"_id": 0, "task_id": 1, "series": 1}
+            ).to_list(length=None)
+
+        completions = await completedtasks.find(
+            {"phone": phone, **changed},
+            {"_id": 0, "id_task": 1, "status": 1, "finish_at": 1}
+        ).to_list(length=None)
+
+        return {
+            "version": version,
+            "full": since <= 0,
+            "tasks": changed_tasks,
+            "replaced_series": replaced_series,
+            "deleted": deleted,
+            "completions": completions
+        }
+    except PyMongoError as e:
+        raise HTTPException(status_code=500, detail="Помилка бази даних")
+
 @user_app.post("/push_task")
 async def push_task(
     start_time: str = Form(...),
@@ -1503,11 +1936,18 @@ async def push_task(
         keyTime: Unique time key
         comment: Optional completion comment
         in_time: 1 if completed on time, 0 otherwise
-        images: List of uploaded photos
+        images: List of uploaded photos (each at most UPLOAD_MAX_BYTES);
+            "thumb" and "review" JPEG variants are stored for each photo
         
     Returns:
         dict: Success message
         
+    Raises:
+        HTTPException:
+            - 400: Invalid time format
+            - 413: A photo is too large
+            - 500: Database error
+        
     Example Request:
         POST /push_task
         Form data:
@@ -1545,17 +1985,13 @@ async def push_task(
                 continue
 
         active_minutes = total_minutes - total_pause_minutes
-        photo_refs = []
-        for image in images:
-            content = await image.read()
-            file_id = await fs.upload_from_stream(image.filename, content)
-            photo_refs.append({
-                "file_id": str(file_id),
-                "filename": image.filename
-            })
+        # Streamed to GridFS in chunks, several photos at once
+        photo_refs = await store_photos(images)
         task_data = {
             "start_time": start_time,
             "finish_time": finish_time,
+            "start_at": dt_start,
+            "finish_at": dt_finish,
             "pause_start": pause_start_list,
             "pause_end": pause_end_list,
             "id_task": id_task,
@@ -1571,10 +2007,13 @@ async def push_task(
             "pause_minutes": int(total_pause_minutes),
             "active_minutes": int(active_minutes)
         }
+        task_data.update(await sync_stamp())
 
         await completedtasks.insert_one(task_data)
 
         return {"message": "Informations about task successfully saved to database"}
+    except HTTPException:
+        raise
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail="Помилка бази даних")
 
@@ -1609,6 +2048,7 @@ async def cancel_task(request: Request, task_cancel: TaskTimeCancel, phone=Depen
     try:
         task_data = {
             "finish_time": task_cancel.cancel_time,
+            "finish_at": parse_client_time(task_cancel.cancel_time),
             "id_task": task_cancel.id_task,
             "phone": phone,
             "comment": task_cancel.comment,
@@ -1616,6 +2056,7 @@ async def cancel_task(request: Request, task_cancel: TaskTimeCancel, phone=Depen
             "task_name": task_cancel.task_name,
             'status': 0
         }
+        task_data.update(await sync_stamp())
         await completedtasks.insert_one(task_data)
         return {"message": "Informations about task successfully saved to database"}
     except PyMongoError as e:
@@ -1625,11 +2066,18 @@ async def cancel_task(request: Request, task_cancel: TaskTimeCancel, phone=Depen
         raise HTTPException(status_code=500, detail="Невідома помилка сервера")
 
 @user_app.get("/get_my_created_task/")
-async def get_created_tasks(request: Request, phone=Depends(auth_middleware_phone_return)):
+async def get_created_tasks(
+    request: Request,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    phone=Depends(auth_middleware_phone_return)
+):
     """
     Retrieves tasks created by the authenticated user.
     
     Args:
+        start_date (str): Optional first day (YYYY-MM-DD) of recurring task occurrences to expand
+        end_date (str): Optional last day (YYYY-MM-DD) of recurring task occurrences to expand
         phone (str): Authenticated user's phone (from dependency)
         
     Returns:
@@ -1654,6 +2102,8 @@ async def get_created_tasks(request: Request, phone=Depends(auth_middleware_phon
         user_tasks = await tasks_cursor.to_list(length=None)
         for task in user_tasks:
             task["_id"] = str(task["_id"])
+        user_tasks.extend(await find_occurrences({'created_by': phone}, start_date, end_date))
+        user_tasks.sort(key=lambda t: t["importance"], reverse=True)
         return user_tasks
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail="Помилка бази даних")
@@ -1681,7 +2131,7 @@ async def get_info_procent_about_task(request: Request, group: str, task_id: str
     """
     try:
         task_id = unquote(task_id)
-        count = await groups.find_one({'group_name': group})
+        count = await group_directory.get(group)
         count2 = await completedtasks.find({'id_task': task_id, 'status': 1}).to_list(length=None)
         return (len(count2)/len(count['user_phones'])) * 100
     except PyMongoError as e:
@@ -1695,9 +2145,11 @@ async def delete_task(request: Request, task_id: str, phone=Depends(auth_middlew
     
     """
     Deletes a task created by the authenticated user.
+
+    For an occurrence of a task series only that occurrence is removed.
     
     Args:
-        task_id (str): Task ID to delete
+        task_id (str): Task ID or series occurrence ID to delete
         phone (str): Authenticated user's phone (must be task creator)
         
     Returns:
@@ -1713,10 +2165,26 @@ async def delete_task(request: Request, task_id: str, phone=Depends(auth_middlew
         {"message": "Task successfully deleted"}
     """
     try:
-        result = await tasks.delete_one({"_id": ObjectId(task_id), 'created_by': phone})
+        occurrence = parse_occurrence_id(task_id)
+        if occurrence:
+            series_id, day = occurrence
+            result = await task_series.update_one(
+                {"_id": series_id, 'created_by': phone},
+                {"$set": {f"overrides.{day}": {"deleted": True}, **(await sync_stamp())}}
+            )
+            if result.matched_count == 0:
+                raise HTTPException(status_code=404, detail="The task was not found or you do not have sufficient rights")
+            return {"message": "Task successfully deleted"}
+
+        deleted = await tasks.find_one_and_delete(
+            {"_id": ObjectId(task_id), 'created_by': phone},
+            {"_id": 1, "group": 1, "created_by": 1}
+        )
         
-        if result.deleted_count == 0:
+        if not deleted:
             raise HTTPException(status_code=404, detail="The task was not found or you do not have sufficient rights")
+
+        await record_tombstones([deleted])
         
         return {"message": "Task successfully deleted"}
     except PyMongoError as e:
@@ -1743,10 +2211,12 @@ async def question_task(
             "phone": data.createdBy,
             "name": data.createdName
         },
-        "type": "question"
+        "type": "question",
+        "conversation": conversation_id(data.taskId, phone, data.createdBy)
     }
 
     await comments.insert_one(message_doc)
+    await record_message(message_doc)
 
     return {
         "status": "ok",
@@ -1756,62 +2226,193 @@ async def question_task(
 
 @user_app.get("/chats")
 async def get_chats(phone: str = Depends(auth_middleware_phone_return)):
-    pipeline = [
-        {"$match": {"$or": [{"author.phone": phone}, {"receiver.phone": phone}]}},
-        {"$group": {
-            "_id": "$task_id",
-            "task_id": {"$first": "$task_id"},
-            "task_title": {"$first": "$task_title"},
-            "author": {"$first": "$author"},
-            "receiver": {"$first": "$receiver"}
-        }},
-        {"$sort": {"task_id": -1}}
-    ]
-    chats_raw = await comments.aggregate(pipeline).to_list(length=None)
+    # Kept for older clients; reads the same conversation summaries as /chats/inbox
+    summaries = await conversation_summaries.find(
+        {"owner_phone": phone},
+        {"_id": 0, "task_id": 1, "task_title": 1, "other_phone": 1}
+    ).sort(INBOX_SORT).to_list(length=None)
+
+    # One entry per task, for its most recent conversation
+    by_task = {}
+    for summary in summaries:
+        by_task.setdefault(summary["task_id"], summary)
+
+    profiles = await user_directory.get_many(summary["other_phone"] for summary in by_task.values())
 
     chats = []
-    for chat in chats_raw:
-        other_user_phone = (
-            chat["receiver"]["phone"]
-            if chat["author"]["phone"] == phone
-            else chat["author"]["phone"]
-        )
+    for task_id in sorted(by_task, reverse=True):
+        summary = by_task[task_id]
+        other_user = profiles.get(summary["other_phone"])
+        chats.append({
+            "task_id": task_id,
+            "task_title": summary.get("task_title"),
+            "other_user": public_profile(other_user) if other_user else None
+        })
+
+    return {"status": "ok", "chats": chats}
+
+INBOX_SORT = [("last_message_at", -1), ("conversation_id", -1)]
+
+@user_app.get("/chats/inbox")
+async def get_inbox(
+    cursor: Optional[str] = None,
+    limit: int = 30,
+    phone: str = Depends(auth_middleware_phone_return)
+):
+    """
+    Retrieves the authenticated user's conversations, most recent first, one page at a time.
+    
+    Replaces calling /chats and /chats/unread separately: every conversation
+    comes with the counterpart's profile, the last message, the unread count and
+    the last activity time, read from the user's conversation summaries.
+    
+    Args:
+        cursor (str): `next_cursor` of the previous page, omitted for the first page
+        limit (int): Page size (1-100)
+        phone (str): Authenticated user's phone (from dependency)
         
-        other_user = await users_collections.find_one(
-            {"phone": other_user_phone},
-            {"password": 0}  
-        )
+    Returns:
+        dict: Page of conversations and the cursor of the next page
+        
+    Example Request:
+        GET /chats/inbox?limit=30
         
-        if other_user:
-            other_user["_id"] = str(other_user["_id"])  
+    Example Response:
+        {
+            "status": "ok",
+            "chats": [
+                {
+                    "conversation": "507f1f77bcf86cd799439011:+380123456789:+380987654321",
+                    "task_id": "507f1f77bcf86cd799439011",
+                    "task_title": "Code Review",
+                    "other_user": {"name": "Alice Smith", "phone": "+380987654321", ...},
+                    "last_message": {"text": "Done", "from_phone": "+380987654321", "created_at": "2023-01-02T11:30:00"},
+                    "unread_count": 2,
+                    "last_activity_at": "2023-01-02T11:30:00"
+                }
+            ],
+            "next_cursor": null
+        }
+    """
+    limit = max(1, min(limit, 100))
+    query = {"owner_phone": phone}
+    if cursor:
+        try:
+            query = {"$and": [query, keyset_after(INBOX_SORT, decode_cursor(cursor))]}
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    summaries = await conversation_summaries.find(query).sort(INBOX_SORT).limit(limit + 1).to_list(length=None)
+
+    next_cursor = None
+    if len(summaries) > limit:
+        summaries = summaries[:limit]
+        next_cursor = encode_cursor([summaries[-1]["last_message_at"], summaries[-1]["conversation_id"]])
 
+    profiles = await user_directory.get_many(summary["other_phone"] for summary in summaries)
+    chats = []
+    for summary in summaries:
+        other_user = profiles.get(summary["other_phone"])
         chats.append({
-            "task_id": chat["task_id"],
-            "task_title": chat["task_title"],
-            "other_user": other_user
+            "conversation": summary["conversation_id"],
+            "task_id": summary["task_id"],
+            "task_title": summary.get("task_title"),
+            "other_user": public_profile(other_user) if other_user else None,
+            "last_message": {
+                "text": summary.get("preview"),
+                "from_phone": summary.get("last_from"),
+                "created_at": summary["last_message_at"]
+            },
+            "unread_count": summary.get("unread_count", 0),
+            "last_activity_at": summary["last_message_at"]
         })
 
-    return {"status": "ok", "chats": chats}
+    return {"status": "ok", "chats": chats, "next_cursor": next_cursor}
 
+MESSAGES_SORT = [("created_at", -1), ("_id", -1)]
 
 @user_app.get("/messages/{task_id}/{other_phone}")
-async def get_chat_messages(task_id: str, other_phone: str, my_phone: str = Depends(auth_middleware_phone_return)):
-    cursor = comments.find({
-        "task_id": task_id,
-        "$or": [
-            {"author.phone": my_phone, "receiver.phone": other_phone},
-            {"author.phone": other_phone, "receiver.phone": my_phone}
-        ]
-    }).sort("created_at", 1)
-
-    messages = []
-    async for msg in cursor:
+async def get_chat_messages(
+    task_id: str,
+    other_phone: str,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+    my_phone: str = Depends(auth_middleware_phone_return)
+):
+    """
+    Retrieves a task chat between the authenticated user and another user, optionally one page at a time.
+    
+    Without `before` and `limit` the whole chat is returned, as before paging
+    existed. With `limit` the latest messages are returned; passing the id of
+    the oldest message already loaded as `before` returns the page preceding
+    it. Messages are ordered from oldest to newest. Comments not yet
+    backfilled with a conversation key are matched by task and phones.
+    
+    Args:
+        task_id (str): Task the conversation belongs to
+        other_phone (str): Phone of the other participant
+        before (str): Message ID to page backwards from, omitted for the latest page
+        limit (int): Page size (1-200, 50 if only `before` is given), omitted for the whole chat
+        my_phone (str): Authenticated user's phone (from dependency)
+        
+    Returns:
+        dict: Messages of the page (or chat) and whether older messages exist
+        
+    Raises:
+        HTTPException: 400 for invalid message ID, 404 if the `before` message is not in this chat
+        
+    Example Request:
+        GET /messages/507f1f77bcf86cd799439011/+380987654321?limit=50&before=65a0f1f77bcf86cd79943901
+        
+    Example Response:
+        {
+            "status": "ok",
+            "messages": [{message1...}, {message2...}],
+            "has_more": true,
+            "before": "65a0e2c17bcf86cd79943811"
+        }
+    """
+    query = {"$or": [
+        {"conversation": conversation_id(task_id, my_phone, other_phone)},
+        {
+            "conversation": {"$exists": False},
+            "task_id": task_id,
+            "$or": [
+                {"author.phone": my_phone, "receiver.phone": other_phone},
+                {"author.phone": other_phone, "receiver.phone": my_phone}
+            ]
+        }
+    ]}
+
+    if before is None and limit is None:
+        page = await comments.find(query).sort([("created_at", 1), ("_id", 1)]).to_list(length=None)
+        for msg in page:
+            msg["_id"] = str(msg["_id"])
+        return {"status": "ok", "messages": page, "has_more": False, "before": None}
+
+    limit = max(1, min(limit or 50, 200))
+    if before:
+        if not ObjectId.is_valid(before):
+            raise HTTPException(status_code=400, detail="Invalid message id")
+        anchor = await comments.find_one({"$and": [{"_id": ObjectId(before)}, query]}, {"created_at": 1})
+        if not anchor:
+            raise HTTPException(status_code=404, detail="Message not found")
+        query = {"$and": [query, keyset_after(MESSAGES_SORT, [anchor["created_at"], anchor["_id"]])]}
+
+    page = await comments.find(query).sort(MESSAGES_SORT).limit(limit + 1).to_list(length=None)
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+
+    for msg in page:
         msg["_id"] = str(msg["_id"])
-        messages.append(msg)
-
-    return {"status": "ok", "messages": messages}
 
-connections: Dict[str, Dict[str, WebSocket]] = {}
+    return {
+        "status": "ok",
+        "messages": page,
+        "has_more": has_more,
+        "before": page[0]["_id"] if has_more else None
+    }
 
 @user_app.websocket("/ws/chat/{task_id}/{phones_pair}")
 async def chat_ws(websocket: WebSocket, task_id: str, phones_pair: str):
@@ -1824,7 +2425,7 @@ async def chat_ws(websocket: WebSocket, task_id: str, phones_pair: str):
         return
 
     try:
-        payload = jwt.decode(token, "test", algorithms=["HS256"])
+        payload = resolve_principal(token)
         my_phone = payload.get("sub")
     except:
         await websocket.close(code=1008)
@@ -1835,10 +2436,9 @@ async def chat_ws(websocket: WebSocket, task_id: str, phones_pair: str):
     # Используем ровно тот chat_id, который прислали с фронта
     chat_id = f"{task_id}_{phones_pair}"
 
-    if chat_id not in connections:
-        connections[chat_id] = {}
-    connections[chat_id][my_phone] = websocket
-    print(f"[CONNECT] chat_id={chat_id}, phones={list(connections[chat_id].keys())}")
+    outbound = OutboundSocket(websocket)
+    await broker.join_chat(chat_id, my_phone, outbound)
+    print(f"[CONNECT] chat_id={chat_id}, phones={list(hub.chats.get(chat_id, {}).keys())}")
 
     try:
         while True:
@@ -1851,72 +2451,186 @@ async def chat_ws(websocket: WebSocket, task_id: str, phones_pair: str):
                 "created_at": datetime.utcnow(),
                 "author": {"phone": my_phone, "role": "client"},
                 "receiver": data["receiver"],
-                "type": "question"
+                "type": "question",
+                "conversation": conversation_id(task_id, my_phone, data["receiver"]["phone"])
             }
 
-            await comments.insert_one(message_doc)
+            # Batched with concurrent chat messages (summaries included); returns once the batch is acknowledged
+            await comment_writer.insert(message_doc)
             outgoing_message = dict(message_doc)
             outgoing_message["created_at"] = message_doc["created_at"].isoformat()
 
             if "_id" in outgoing_message:
                 outgoing_message["_id"] = str(outgoing_message["_id"])
 
-            # Рассылаем всем подключенным по chat_id
-            for phone, ws in connections[chat_id].items():
-                try:
-                    await ws.send_json(outgoing_message)
-                    print(f"[SENT] to {phone}: {outgoing_message['text']}")
-                except Exception as e:
-                    print(f"[ERROR] sending to {phone}: {e}")
-            print(f"[BROADCAST] chat_id={chat_id}, phones={list(connections[chat_id].keys())}")
+            # Рассылаем всем подключенным по chat_id (на всех воркерах)
+            await broker.publish_chat(chat_id, outgoing_message)
+            print(f"[BROADCAST] chat_id={chat_id}")
             receiver_phone = data["receiver"]["phone"]
-            ws_global = global_connections.get(receiver_phone)
-
-            if ws_global:
-                await ws_global.send_json({
-                    "type": "new_message",
-                    "task_id": task_id,
-                    "from_phone": my_phone,
-                    "created_at": outgoing_message["created_at"]
-                })
-            receiver_in_chat = (
-                chat_id in connections and
-                receiver_phone in connections[chat_id]
-            )
+
+            await broker.publish_notification(receiver_phone, {
+                "type": "new_message",
+                "task_id": task_id,
+                "from_phone": my_phone,
+                "created_at": outgoing_message["created_at"]
+            })
+            receiver_in_chat = await broker.is_in_chat(chat_id, receiver_phone)
 
             if receiver_in_chat:
                 print("❌ Пользователь в чате — Telegram не отправляем")
             else:
                 print("✅ Пользователь НЕ в чате — отправляем в Telegram")
-                user = await users_collections.find_one({"phone": receiver_phone})
+                user = await user_directory.get(receiver_phone)
                 if not user:
                     print("Пользователь с таким телефоном не найден")
+                elif not user.get("telegram_chat_id"):
+                    print("Chat_id для Telegram не найден")
                 else:
-                    username = user.get("telegramName") 
-                    print(f"Найден пользователь: {username}") 
-
-                    telegram_user = await telegram_users.find_one({"username": username}) 
-                    if not telegram_user:
-                        print("Chat_id для Telegram не найден")
-                    else:
-                        chat_id_tg = telegram_user.get("chat_id")
-                        print(f"Chat_id Telegram: {chat_id_tg}")
-
-                try:
-                    await bot.send_message(
-                        chat_id=chat_id_tg,
-                        text=f"Нове повідомлення по таску '{data['task_title']}' від {my_phone}:\n{data['text']}"
+                    # Delivered by the outbox dispatcher, Telegram never blocks the chat loop
+                    await enqueue_digest(
+                        user["telegram_chat_id"],
+                        receiver_phone,
+                        data["task_title"],
+                        f"Нове повідомлення по таску '{data['task_title']}' від {my_phone}:\n{data['text']}",
+                        await notification_window(receiver_phone)
                     )
-                except Exception as e:
-                    print(f"TG error: {e}")
 
     except WebSocketDisconnect:
-        if chat_id in connections and my_phone in connections[chat_id]:
-            del connections[chat_id][my_phone]
-            if not connections[chat_id]:
-                del connections[chat_id]
+        pass
+    finally:
+        await broker.leave_chat(chat_id, my_phone, outbound)
+        await outbound.close(code=1000)
+
+@user_app.post("/telegram/link")
+async def create_telegram_link(phone: str = Depends(auth_middleware_phone_return)):
+    """
+    Creates a one-time deep link that binds the user's Telegram chat to their phone.
+
+    Opening the link starts the bot with `/start <token>`; the bot then stores
+    the chat_id for this phone in TelegramBindings. The link expires after
+    TELEGRAM_LINK_TTL seconds.
+
+    Returns:
+        dict: Deep link and its expiration time
+
+    Raises:
+        HTTPException:
+            - 500: Database error
+
+    Example Request:
+        POST /telegram/link
+
+    Example Response:
+        {
+            "status": "ok",
+            "link": "https://t.me/tasks_bot?start=Qm9vX2V4YW1wbGVfdG9rZW4xMjM0NTY",
+            "expires_at": "2024-05-01T12:15:00"
+        }
+    """
+    token = secrets.token_urlsafe(24)
+    expires_at = datetime.utcnow() + timedelta(seconds=TELEGRAM_LINK_TTL)
+    try:
+        await telegram_link_tokens.insert_one({"token": token, "phone": phone, "expires_at": expires_at})
+    except PyMongoError:
+        raise HTTPException(status_code=500, detail="Помилка бази даних")
 
-global_connections: Dict[str, WebSocket] = {}
+    return {
+        "status": "ok",
+        "link": f"https://t.me/{application.bot.username}?start={token}",
+        "expires_at": expires_at.isoformat()
+    }
+
+@user_app.get("/notifications/settings")
+async def get_notification_settings(phone: str = Depends(auth_middleware_phone_return)):
+    """
+    Returns the authenticated user's notification digest window.
+
+    Example Request:
+        GET /notifications/settings
+
+    Example Response:
+        {"status": "ok", "window": 30}
+    """
+    return {"status": "ok", "window": await notification_window(phone)}
+
+@user_app.post("/notifications/settings")
+async def update_notification_settings(
+    settings: NotificationSettings,
+    phone: str = Depends(auth_middleware_phone_return)
+):
+    """
+    Sets how long new-message notifications are collected into one digest.
+
+    Applies to both /ws/notifications frames and Telegram messages. The first
+    message after a quiet period is always delivered right away; only the
+    ones following it within the window are collected. Other
+    workers pick the change up once their cached profile expires.
+
+    Args:
+        settings (NotificationSettings): Digest window in seconds, 0 to notify on every message
+
+    Raises:
+        HTTPException:
+            - 404: User not found
+            - 500: Database error
+
+    Example Request:
+        POST /notifications/settings
+        {"window": 120}
+
+    Example Response:
+        {"status": "ok", "window": 120}
+    """
+    try:
+        result = await users_collections.update_one(
+            {"phone": phone},
+            {"$set": {"notification_window": settings.window}}
+        )
+    except PyMongoError:
+        raise HTTPException(status_code=500, detail="Помилка бази даних")
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Користувача не знайдено")
+    user_directory.invalidate(phone)
+
+    return {"status": "ok", "window": settings.window}
+
+@user_app.get("/telegram/outbox/stats", dependencies=[Depends(verify_admin_token)])
+async def telegram_outbox_stats():
+    """
+    Reports Telegram outbox delivery metrics (admin-only).
+
+    Returns:
+        dict: Message counts per status in the outbox and this worker's dispatcher counters
+
+    Example Request:
+        GET /telegram/outbox/stats
+
+    Example Response:
+        {
+            "status": "ok",
+            "outbox": {"pending": 3, "sending": 1, "sent": 1520, "failed": 4},
+            "dispatcher": {
+                "sent": 812,
+                "retried": 9,
+                "failed": 2,
+                "rate_limited": 1,
+                "in_flight": 1,
+                "avg_delivery_seconds": 0.84
+            }
+        }
+    """
+    try:
+        counts = await telegram_outbox.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(length=None)
+    except PyMongoError:
+        raise HTTPException(status_code=500, detail="Помилка бази даних")
+
+    return {
+        "status": "ok",
+        "outbox": {c["_id"]: c["count"] for c in counts},
+        "dispatcher": outbox_dispatcher.snapshot()
+    }
 
 @user_app.websocket("/ws/notifications")
 async def notifications_ws(websocket: WebSocket):
@@ -1926,22 +2640,25 @@ async def notifications_ws(websocket: WebSocket):
         return
 
     try:
-        payload = jwt.decode(token, "test", algorithms=["HS256"])
+        payload = resolve_principal(token)
         my_phone = payload.get("sub")
     except:
         await websocket.close(code=1008)
         return
 
     await websocket.accept()
-    global_connections[my_phone] = websocket
+    outbound = OutboundSocket(websocket)
+    hub.add_notification(my_phone, outbound)
     print(f"[GLOBAL CONNECT] phone={my_phone}")
 
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        global_connections.pop(my_phone, None)
         print(f"[GLOBAL DISCONNECT] phone={my_phone}")
+    finally:
+        hub.remove_notification(my_phone, outbound)
+        await outbound.close(code=1000)
             
 @user_app.post("/chats/read")
 async def mark_chat_read(
@@ -1961,6 +2678,7 @@ async def mark_chat_read(
         },
         upsert=True
     )
+    await mark_conversation_read(my_phone, body.task_id, body.other_user_phone)
 
     return {"status": "ok"}
 
@@ -1968,67 +2686,16 @@ async def mark_chat_read(
 async def get_unread_chats(
     phone: str = Depends(auth_middleware_phone_return)
 ):
-    pipeline = [
-    {
-        "$match": {"receiver.phone": phone}
-    },
-    {
-        "$lookup": {
-            "from": "ChatReadState",
-            "let": {"task_id": "$task_id", "author_phone": "$author.phone"},
-            "pipeline": [
-                {
-                    "$match": {
-                        "$expr": {
-                            "$and": [
-                                {"$eq": ["$user_phone", phone]},
-                                {"$eq": ["$task_id", "$$task_id"]},
-                                {"$eq": ["$other_user_phone", "$$author_phone"]}
-                            ]
-                        }
-                    }
-                }
-            ],
-            "as": "read_state"
-        }
-    },
-    {
-        "$unwind": {
-            "path": "$read_state",
-            "preserveNullAndEmptyArrays": True  
-        }
-    },
-    {
-        "$group": {
-            "_id": {"task_id": "$task_id", "from_phone": "$author.phone"},
-            "last_message_at": {"$max": "$created_at"},
-            "last_read_at": {"$max": "$read_state.last_read_at"} 
-        }
-    },
-    {
-        "$project": {
-            "task_id": "$_id.task_id",
-            "from_phone": "$_id.from_phone",
-            "last_message_at": 1,
-            "last_read_at": 1,
-            "is_unread": {
-                "$cond": [
-                    {"$or": [{"$eq": ["$last_read_at", None]}, {"$gt": ["$last_message_at", "$last_read_at"]}]},
-                    True,
-                    False
-                ]
-            }
-        }
-    }
-]
-
-    unread = await comments.aggregate(pipeline).to_list(None)
+    unread = await conversation_summaries.find(
+        {"owner_phone": phone, "unread_count": {"$gt": 0}},
+        {"_id": 0, "task_id": 1, "other_phone": 1, "unread_count": 1, "last_message_at": 1, "last_read_at": 1}
+    ).to_list(None)
 
     return {
         "status": "ok",
         "debug": unread, 
         "unread": [
-            f"{u['task_id']}_{u['from_phone']}" for u in unread if u["is_unread"]
+            f"{u['task_id']}_{u['other_phone']}" for u in unread
         ]
     }
     
@@ -2037,6 +2704,9 @@ async def update_task(request: Request, task: TaskEdit, phone=Depends(auth_middl
     """
     Updates an existing task created by the authenticated user.
     
+    For an occurrence of a task series only the OCCURRENCE_FIELDS are
+    overridden for that day; deleted occurrences cannot be edited.
+    
     Args:
         task (TaskEdit): Updated task data
         phone (str): Authenticated user's phone (must be task creator)
@@ -2045,7 +2715,7 @@ async def update_task(request: Request, task: TaskEdit, phone=Depends(auth_middl
         dict: Success message
         
     Raises:
-        HTTPException: 404 if task not found or not creator
+        HTTPException: 404 if task not found, not creator, or not an existing occurrence
         
     Example Request:
         PUT /update_task/
@@ -2085,15 +2755,38 @@ async def update_task(request: Request, task: TaskEdit, phone=Depends(auth_middl
         'openquestion': task.openquestion,
     }
     try:
-        result = await tasks.update_one(
-            {"_id": ObjectId(task.taskid), 'created_by': phone},
-            {"$set": task_data}
-        )
+        occurrence = parse_occurrence_id(task.taskid)
+        stamp = await sync_stamp()
+        if occurrence:
+            # Editing one occurrence of a series stores a per-occurrence override;
+            # deleted occurrences cannot be edited back into existence
+            series_id, day = occurrence
+            series = await task_series.find_one(
+                {"_id": series_id, 'created_by': phone},
+                {"start_date": 1, "end_date": 1, "task_type": 1, "repeat_days": 1}
+            )
+            # Only days the series actually occurs on can be overridden
+            if not series or day not in series_days(series, day, day):
+                raise HTTPException(status_code=404, detail="Failed to update task")
+            result = await task_series.update_one(
+                {"_id": series_id, 'created_by': phone, f"overrides.{day}.deleted": {"$ne": True}},
+                {"$set": {
+                    **{f"overrides.{day}.{field}": task_data[field] for field in OCCURRENCE_FIELDS},
+                    **stamp
+                }}
+            )
+        else:
+            result = await tasks.update_one(
+                {"_id": ObjectId(task.taskid), 'created_by': phone},
+                {"$set": {**task_data, **stamp}}
+            )
         
         if result.modified_count > 0:
             return {"message": "Task successfully updated"}
         else:
             raise HTTPException(status_code=404, detail="Failed to update task")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update task: {str(e)}")
 
@@ -2102,13 +2795,17 @@ async def get_task_by_id(
     task_id: str,
     phone=Depends(auth_middleware_phone_return)
 ):
-    if not ObjectId.is_valid(task_id):
+    if parse_occurrence_id(task_id):
+        task = await get_occurrence(task_id)
+        if task:
+            del task["_id"]
+    elif not ObjectId.is_valid(task_id):
         raise HTTPException(status_code=400, detail="Invalid task id")
-
-    task = await tasks.find_one(
-        {"_id": ObjectId(task_id)},
-        {"_id": 0}
-    )
+    else:
+        task = await tasks.find_one(
+            {"_id": ObjectId(task_id)},
+            {"_id": 0}
+        )
 
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
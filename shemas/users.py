@@ -375,3 +375,17 @@ class TaskTimeCancel(BaseModel):
     group: str
     comment: str
 
+
+class NotificationSettings(BaseModel):
+    """
+    Schema for the user's notification digest settings.
+    
+    Attributes:
+        window (int): Seconds new-message notifications are collected into one digest (0 = send each message)
+        
+    Example:
+        {
+            "window": 60
+        }
+    """
+    window: int = Field(..., ge=0, le=3600)
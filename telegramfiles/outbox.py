@@ -0,0 +1,327 @@
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from telegramfiles.startpage import bot
+from db.dbconn import telegram_outbox, telegram_rate_limits
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError, DuplicateKeyError
+from datetime import datetime, timedelta
+import asyncio
+import os
+import time
+
+# Messages delivered at the same time by one worker
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+
+# Telegram allows about 30 messages per second overall and one per second per chat
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_CHAT_INTERVAL = float(os.getenv("OUTBOX_CHAT_INTERVAL", "1"))
+
+# Retries use exponential backoff starting at OUTBOX_BACKOFF seconds, capped at OUTBOX_BACKOFF_MAX
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF = float(os.getenv("OUTBOX_BACKOFF", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+
+# A claimed message not finished within the lease is picked up again (e.g. after a crash)
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "60"))
+
+# How often the outbox is polled for messages enqueued by other workers or due for retry
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+
+
+async def enqueue_telegram(chat_id, text: str, phone: str = None, **fields):
+    """
+    Stores a Telegram message in the outbox; the dispatcher delivers it later.
+
+    Returns immediately after the insert, so callers never wait for Telegram.
+    `fields` are stored with the message (e.g. digest bookkeeping).
+    """
+    now = datetime.utcnow()
+    await telegram_outbox.insert_one({
+        "chat_id": chat_id,
+        "phone": phone,
+        "text": text,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now,
+        **fields
+    })
+    outbox_dispatcher.wake()
+
+
+async def reserve_send(key: str, interval: float, not_before: int, limit: float) -> tuple:
+    """
+    Reserves the next send slot of a rate limit shared by every worker.
+
+    The limit `key` allows one send per `interval` seconds. A slot is taken
+    only if it starts within `limit` seconds (and never before `not_before`,
+    in server milliseconds), so a caller that cannot wait leaves nothing
+    reserved. Times follow the database server clock.
+
+    Returns:
+        tuple: (start of the slot in server milliseconds, seconds until it, whether it was reserved)
+    """
+    interval_ms = int(interval * 1000)
+    limit_ms = int(limit * 1000)
+    limiter = await telegram_rate_limits.find_one_and_update(
+        {"_id": key},
+        [
+            {"$set": {"now": {"$toLong": "$$NOW"}}},
+            {"$set": {"at": {"$max": [{"$ifNull": ["$value", 0]}, "$now", not_before]}}},
+            {"$set": {
+                "reserved": {"$lte": [{"$subtract": ["$at", "$now"]}, limit_ms]},
+                "value": {"$cond": [
+                    {"$lte": [{"$subtract": ["$at", "$now"]}, limit_ms]},
+                    {"$add": ["$at", interval_ms]},
+                    {"$ifNull": ["$value", 0]}
+                ]}
+            }},
+            {"$set": {"expires_at": {"$toDate": {"$add": ["$value", 60_000]}}}}
+        ],
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return limiter["at"], (limiter["at"] - limiter["now"]) / 1000, limiter["reserved"]
+
+
+async def pause_sends(key: str, seconds: float):
+    # Pushes a shared rate limit back, e.g. after Telegram answered with retry_after
+    await telegram_rate_limits.update_one(
+        {"_id": key},
+        [{"$set": {
+            "value": {"$max": [{"$ifNull": ["$value", 0]}, {"$add": [{"$toLong": "$$NOW"}, int(seconds * 1000)]}]},
+            "expires_at": {"$toDate": {"$add": [{"$toLong": "$$NOW"}, int(seconds * 1000) + 60_000]}}
+        }}],
+        upsert=True
+    )
+
+
+async def enqueue_digest(chat_id, phone: str, task_title: str, text: str, window: float):
+    """
+    Adds a chat message to the recipient's Telegram digest.
+
+    The first message after a quiet period is sent right away and opens a
+    window of `window` seconds (`window_until`). Messages arriving while a
+    window is open are collected in a single outbox entry (status
+    "collecting") that becomes due when the window closes and opens the
+    next one; it is sent as the message itself if nothing else arrived, or
+    as a summary.
+    """
+    now = datetime.utcnow()
+    message = {"$inc": {"count": 1}, "$addToSet": {"task_titles": task_title}, "$set": {"text": text}}
+    if window > 0:
+        joined = await telegram_outbox.update_one({"phone": phone, "status": "collecting"}, message)
+        if joined.matched_count:
+            return
+        opened = await telegram_outbox.find_one(
+            {"phone": phone, "window_until": {"$gt": now}}, {"window_until": 1}, sort=[("window_until", -1)]
+        )
+        if opened:
+            due = opened["window_until"]
+            for _ in range(2):
+                try:
+                    await telegram_outbox.update_one(
+                        {"phone": phone, "status": "collecting"},
+                        {
+                            **message,
+                            "$setOnInsert": {
+                                "chat_id": chat_id,
+                                "attempts": 0,
+                                "created_at": now,
+                                "next_attempt_at": due,
+                                "window_until": due + timedelta(seconds=window)
+                            }
+                        },
+                        upsert=True
+                    )
+                    return
+                except DuplicateKeyError:
+                    # Another message opened the digest at the same moment; join it
+                    continue
+            return
+
+    await enqueue_telegram(
+        chat_id, text, phone,
+        count=1, task_titles=[task_title], window_until=now + timedelta(seconds=max(window, 0))
+    )
+
+
+def render_text(message: dict) -> str:
+    if message.get("count", 1) <= 1:
+        return message["text"]
+    titles = message.get("task_titles", [])
+    shown = ", ".join(f"'{title}'" for title in titles[:5])
+    more = f" та ще {len(titles) - 5}" if len(titles) > 5 else ""
+    return f"📬 {message['count']} нових повідомлень у {len(titles)} тасках: {shown}{more}"
+
+
+class OutboxDispatcher:
+    """
+    Background delivery of TelegramOutbox messages.
+
+    Messages are claimed one at a time with find_one_and_update, so several
+    workers can share the outbox without sending a message twice. Sends run
+    concurrently up to OUTBOX_CONCURRENCY and are spaced to stay within the
+    global and per-chat rate limits; both budgets live in TelegramRateLimits,
+    so they hold for all workers together, not per process. Failures are retried with exponential
+    backoff (or after Telegram's retry_after); blocked chats and bad requests
+    fail immediately. Digests are claimed once their window has passed.
+    Counters are kept in `metrics`.
+    """
+
+    def __init__(self):
+        self.metrics = {"sent": 0, "retried": 0, "failed": 0, "rate_limited": 0}
+        self._latency_total = 0.0
+        self._slots = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._tasks = set()
+        self._loop_task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def start(self):
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+
+    def snapshot(self) -> dict:
+        sent = self.metrics["sent"]
+        return {
+            **self.metrics,
+            "in_flight": len(self._tasks),
+            "avg_delivery_seconds": round(self._latency_total / sent, 3) if sent else None
+        }
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        return await telegram_outbox.find_one_and_update(
+            {"$or": [
+                {"status": {"$in": ["pending", "collecting"]}, "next_attempt_at": {"$lte": now}},
+                {"status": "sending", "locked_until": {"$lt": now}}
+            ]},
+            {
+                "$set": {"status": "sending", "locked_until": now + timedelta(seconds=OUTBOX_LEASE)},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _run(self):
+        while True:
+            holding = False
+            try:
+                await self._slots.acquire()
+                holding = True
+                # While Telegram asked every sender to pause, claiming would only hand messages back
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                self._wakeup.clear()
+                message = await self._claim()
+                if message is None:
+                    holding = False
+                    self._slots.release()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                task = asyncio.create_task(self._deliver(message))
+                holding = False
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep dispatching; an unexpected error must not stop the outbox for good
+                if holding:
+                    self._slots.release()
+                label = "claim failed" if isinstance(e, PyMongoError) else "dispatcher error"
+                print(f"[OUTBOX] {label}: {e!r}")
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+    async def _wait_for_rate(self, chat_id) -> float:
+        """
+        Reserves the next free send time for both limits and sleeps until it.
+
+        Returns 0 once the message may be sent. If the send time lies beyond
+        half of the lease, the wait is returned instead, so the caller hands
+        the message back rather than sleeping while another worker may claim
+        it again.
+        """
+        limit = OUTBOX_LEASE / 2
+        at, wait, reserved = await reserve_send(f"chat:{chat_id}", OUTBOX_CHAT_INTERVAL, 0, limit)
+        if not reserved:
+            return wait
+        _, wait, reserved = await reserve_send("global", 1 / OUTBOX_GLOBAL_RATE, at, limit)
+        if not reserved:
+            return wait
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return 0
+
+    async def _deliver(self, message: dict):
+        try:
+            wait = await self._wait_for_rate(message["chat_id"])
+            if wait:
+                await self._retry(message, wait, "rate limited", count_attempt=False)
+                return
+            try:
+                await bot.send_message(chat_id=message["chat_id"], text=render_text(message))
+            except RetryAfter as e:
+                self.metrics["rate_limited"] += 1
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+                # Telegram asks every sender to pause, not just this chat
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                await pause_sends("global", retry_after)
+                await self._retry(message, retry_after, f"retry after {retry_after}s", count_attempt=False)
+            except (Forbidden, BadRequest) as e:
+                await self._fail(message, str(e))
+            except Exception as e:
+                if message["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                    await self._fail(message, str(e))
+                else:
+                    delay = min(OUTBOX_BACKOFF * 2 ** (message["attempts"] - 1), OUTBOX_BACKOFF_MAX)
+                    await self._retry(message, delay, str(e))
+            else:
+                now = datetime.utcnow()
+                await telegram_outbox.update_one(
+                    {"_id": message["_id"]},
+                    {"$set": {"status": "sent", "sent_at": now, "finished_at": now}, "$unset": {"locked_until": ""}}
+                )
+                self.metrics["sent"] += 1
+                self._latency_total += (now - message["created_at"]).total_seconds()
+        except PyMongoError as e:
+            # The lease expires and another attempt picks the message up
+            print(f"[OUTBOX] could not record delivery of {message['_id']}: {e}")
+        finally:
+            self._slots.release()
+
+    async def _retry(self, message: dict, delay: float, error: str, count_attempt: bool = True):
+        update = {"$set": {
+            "status": "pending",
+            "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+            "last_error": error
+        }, "$unset": {"locked_until": ""}}
+        if not count_attempt:
+            update["$inc"] = {"attempts": -1}
+        await telegram_outbox.update_one({"_id": message["_id"]}, update)
+        self.metrics["retried"] += 1
+        print(f"[OUTBOX] chat_id={message['chat_id']} retry in {delay:.0f}s: {error}")
+
+    async def _fail(self, message: dict, error: str):
+        await telegram_outbox.update_one(
+            {"_id": message["_id"]},
+            {"$set": {"status": "failed", "last_error": error, "finished_at": datetime.utcnow()}, "$unset": {"locked_until": ""}}
+        )
+        self.metrics["failed"] += 1
+        print(f"[OUTBOX] chat_id={message['chat_id']} failed after {message['attempts']} attempts: {error}")
+
+
+outbox_dispatcher = OutboxDispatcher()
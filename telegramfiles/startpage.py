@@ -1,7 +1,10 @@
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 import os
-from db.dbconn import telegram_users
+from db.dbconn import telegram_link_tokens
+from db.group_commit import telegram_user_writer, telegram_binding_writer
+from pymongo import UpdateOne
+from db.user_directory import user_directory
 from datetime import datetime
 from telegram import Bot
 
@@ -9,28 +12,69 @@ BOT_TOKEN = os.getenv("TelegramToken")
 
 bot = Bot(token=BOT_TOKEN)
 
+async def bind_phone(token: str, user, chat) -> bool:
+    """
+    Binds the chat to the phone that requested the /start link token.
+
+    Tokens are single use and expire; returns False for unknown or expired ones.
+    """
+    now = datetime.utcnow()
+    link = await telegram_link_tokens.find_one_and_delete({"token": token, "expires_at": {"$gt": now}})
+    if not link:
+        return False
+
+    await telegram_binding_writer.write(UpdateOne(
+        {"phone": link["phone"]},
+        {"$set": {
+            "phone": link["phone"],
+            "chat_id": chat.id,
+            "telegram_id": user.id,
+            "username": user.username,
+            "linked_at": now
+        }},
+        upsert=True
+    ))
+    user_directory.invalidate(link["phone"])
+    return True
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
 
+    # Deep link from the app: https://t.me/<bot>?start=<token>
+    if context.args:
+        if await bind_phone(context.args[0], user, chat):
+            await update.message.reply_text("✅ Telegram успішно привʼязаний до акаунта")
+        else:
+            await update.message.reply_text("❌ Посилання недійсне або застаріле. Отримайте нове в застосунку")
+        return
+
     data = {
         "telegram_id": user.id,
         "chat_id": chat.id,
-        "username": '@' + user.username,
+        "username": '@' + user.username if user.username else None,
         "first_name": user.first_name,
         "last_name": user.last_name,
         "linked_at": datetime.utcnow(),
     }
 
-    telegram_users.update_one(
+    await telegram_user_writer.write(UpdateOne(
         {"telegram_id": user.id},
         {"$set": data},
         upsert=True
-    )
+    ))
+    # Cached profiles resolve chat_id by username, which may have just changed
+    user_directory.invalidate()
+
+    if not user.username:
+        await update.message.reply_text(
+            "ℹ️ Щоб отримувати сповіщення, відкрийте посилання для Telegram у застосунку"
+        )
+        return
 
     await update.message.reply_text(
         "✅ Telegram успішно привʼязаний до акаунта"
     )
 
 application = ApplicationBuilder().token(BOT_TOKEN).build()
-application.add_handler(CommandHandler("start", start))
\ No newline at end of file
+application.add_handler(CommandHandler("start", start))
@@ -0,0 +1,82 @@
+from telegram import Update
+from telegramfiles.startpage import application
+from db.dbconn import telegram_updates
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from datetime import datetime
+import asyncio
+import os
+
+# Updates processed at the same time
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+
+# Updates waiting for a worker; beyond this the webhook asks Telegram to retry later
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+
+class WebhookIngestor:
+    """
+    Accepts Telegram webhook updates without processing them in the request.
+
+    Every update_id is recorded in TelegramUpdates (unique index, expiring
+    after TELEGRAM_UPDATE_TTL), so updates redelivered by Telegram are
+    acknowledged and skipped. Payloads without an update_id are acknowledged
+    and dropped. New updates go to a bounded queue drained by
+    WEBHOOK_WORKERS background workers; the handlers' writes are batched
+    across concurrent updates (db.group_commit).
+    """
+
+    def __init__(self, workers: int, maxsize: int):
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+    async def submit(self, data: dict) -> bool:
+        """
+        Records and queues one update.
+
+        Returns:
+            bool: False if the queue is full and the update should be redelivered
+        """
+        update_id = data.get("update_id")
+        if not isinstance(update_id, int):
+            # Not a Telegram update; recording it would make every later one look like a redelivery
+            print("[WEBHOOK] update without update_id rejected")
+            return True
+        if self._queue.full():
+            return False
+        try:
+            await telegram_updates.insert_one({"update_id": update_id, "received_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            print(f"[WEBHOOK] duplicate update {update_id} skipped")
+            return True
+        try:
+            self._queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Forget the update so the redelivery is not treated as a duplicate
+            await telegram_updates.delete_one({"update_id": update_id})
+            return False
+        return True
+
+    async def _work(self):
+        while True:
+            data = await self._queue.get()
+            try:
+                await application.process_update(Update.de_json(data, application.bot))
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                print(f"[WEBHOOK] database error in update {data.get('update_id')}: {e}")
+            except Exception as e:
+                print(f"[WEBHOOK] update {data.get('update_id')} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+webhook_ingestor = WebhookIngestor(WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)